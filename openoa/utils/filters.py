@@ -4,21 +4,20 @@ intended for application in wind plant operational energy analysis, particularly
 """
 
 from __future__ import annotations
+import os
 from typing import Literal
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import polars as pl
-import scipy as sp
+import polars.selectors as cs
 import pandas as pd
-from sklearn.cluster import KMeans
-# from memory_profiler import profile
-from psutil import virtual_memory
+import numexpr as ne
+from scipy import ndimage
+from sklearn.cluster import MiniBatchKMeans
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-from concurrent.futures import ProcessPoolExecutor
-import multiprocessing as mp
-import os
-
 from openoa.utils._converters import (
     series_to_df,
     series_method,
@@ -28,6 +27,16 @@ from openoa.utils._converters import (
 
 from openoa.utils.imputing import asset_correlation_matrix_pl, asset_correlation_matrix_pd
 
+numba_exists = False
+try:
+    from numba import njit, prange, get_num_threads
+    numba_exists = True
+except ModuleNotFoundError:
+    pass
+
+# Minimum number of rows for which the compiled filter kernels are used, when numba is available
+NUMBA_MIN_ROWS = 100_000
+
 def range_flag(
     data: pd.DataFrame | pd.Series,
     lower: float | list[float],
@@ -67,19 +76,127 @@ def range_flag(
         raise ValueError("The inputs to `col`, `above`, and `below` must be the same length.")
 
     # Only flag the desired columns
-    subset = data.loc[:, col].copy()
+    subset = data.loc[:, col]
     flag = ~(subset.ge(lower) & subset.le(upper))
 
     # Return back a pd.Series if one was provided, else a pd.DataFrame
     return flag[col[0]] if to_series else flag
 
 
+if numba_exists:
+    @njit(parallel=True, cache=True)
+    def _unresponsive_runs(x: np.ndarray, threshold: int, out: np.ndarray) -> None:
+        """Flags the values of each column of :py:attr:`x` that are part of a run of at least
+        :py:attr:`threshold` repeated values in a single pass over the data. NaN values are never
+        equal to each other, so they always break a run.
+
+        Args:
+            x (:obj:`numpy.ndarray`): 2-D array of numeric data, with each column being checked.
+            threshold (:obj:`int`): minimum run length to be flagged.
+            out (:obj:`numpy.ndarray`): boolean array the same shape as :py:attr:`x` that the
+                flags are written to.
+        """
+        n, m = x.shape
+        for j in prange(m):
+            run = 1
+            for i in range(n):
+                if i > 0 and x[i, j] == x[i - 1, j]:
+                    run += 1
+                else:
+                    run = 1
+                out[i, j] = run >= threshold
+                # Flag the start of the run once it is long enough
+                if run == threshold:
+                    for k in range(i - threshold + 1, i):
+                        out[k, j] = True
+
+
+    @njit(parallel=True, cache=True)
+    def _bin_flag(
+        values: np.ndarray,
+        labels: np.ndarray,
+        n_labels: int,
+        threshold: float,
+        use_std: bool,
+        above: bool,
+        below: bool,
+        n_chunks: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Flags the values that are outside of the threshold from the mean of their bin. Each
+        thread accumulates the count, mean, and sum of squared differences of its chunk of the data
+        for each bin using Welford's algorithm, which are then combined to flag the data in a
+        second pass. NaN values are excluded from the statistics and are never flagged.
+
+        Args:
+            values (:obj:`numpy.ndarray`): values to be flagged.
+            labels (:obj:`numpy.ndarray`): bin index of each value, in the range [0, `n_labels`).
+            n_labels (:obj:`int`): number of bins.
+            threshold (:obj:`float`): multiplicative factor on the standard deviation of each bin,
+                if :py:attr:`use_std`, otherwise the scalar deviation from the mean.
+            use_std (:obj:`bool`): use a standard deviation based threshold.
+            above (:obj:`bool`): flag values above the mean plus the deviation.
+            below (:obj:`bool`): flag values below the mean minus the deviation.
+            n_chunks (:obj:`int`): number of chunks to accumulate in parallel.
+
+        Returns:
+            tuple[:obj:`numpy.ndarray`, :obj:`numpy.ndarray`]: boolean flag for each value, and
+                the mean of each bin.
+        """
+        n = values.size
+        chunk_size = (n + n_chunks - 1) // n_chunks
+        count = np.zeros((n_chunks, n_labels))
+        mean = np.zeros((n_chunks, n_labels))
+        m2 = np.zeros((n_chunks, n_labels))
+        for c in prange(n_chunks):
+            for i in range(c * chunk_size, min(n, (c + 1) * chunk_size)):
+                v = values[i]
+                if np.isnan(v):
+                    continue
+                b = labels[i]
+                count[c, b] += 1
+                delta = v - mean[c, b]
+                mean[c, b] += delta / count[c, b]
+                m2[c, b] += delta * (v - mean[c, b])
+
+        # Combine the statistics of each chunk
+        center = np.full(n_labels, np.nan)
+        deviation = np.full(n_labels, np.nan)
+        for b in range(n_labels):
+            n_b = 0.0
+            mean_b = 0.0
+            m2_b = 0.0
+            for c in range(n_chunks):
+                n_c = count[c, b]
+                if n_c == 0:
+                    continue
+                n_ab = n_b + n_c
+                delta = mean[c, b] - mean_b
+                mean_b += delta * n_c / n_ab
+                m2_b += m2[c, b] + delta * delta * n_b * n_c / n_ab
+                n_b = n_ab
+            if n_b > 0:
+                center[b] = mean_b
+            if not use_std:
+                deviation[b] = threshold
+            elif n_b > 1:
+                deviation[b] = np.sqrt(m2_b / (n_b - 1)) * threshold
+
+        flag = np.zeros(n, dtype=np.bool_)
+        for i in prange(n):
+            b = labels[i]
+            if above and values[i] > center[b] + deviation[b]:
+                flag[i] = True
+            if below and values[i] < center[b] - deviation[b]:
+                flag[i] = True
+        return flag, center
+
+
 def unresponsive_flag(
     data_pd: pd.DataFrame | pd.Series | None = None,
     data_pl : pl.LazyFrame | None = None,
     threshold: int = 3,
     col: list[str] | None = None,
-) -> pd.Series | pd.DataFrame:
+) -> pd.Series | pd.DataFrame | pl.LazyFrame:
     """Flag time stamps for which the reported data does not change for `threshold` repeated intervals.
 
     Args:
@@ -94,8 +211,9 @@ def unresponsive_flag(
             Defaults to 3.
 
     Returns:
-        :obj:`pandas.Series` | `pandas.DataFrame`: Series or DataFrame (depending on ``data`` type) with
-            boolean entries.
+        :obj:`pandas.Series` | `pandas.DataFrame` | `polars.LazyFrame`: Series or DataFrame (depending
+            on ``data`` type) with boolean entries, or a LazyFrame of boolean columns when
+            :py:attr:`data_pl` is provided.
     """
     # Prepare the inputs to be standardized for use with DataFrames
     if data_pd is not None:
@@ -107,92 +225,166 @@ def unresponsive_flag(
         if not isinstance(threshold, int):
             raise TypeError("The input to `threshold` must be an integer.")
 
-        # Get boolean value of the difference in successive time steps is not equal to zero, and take the
-        # rolling sum of the boolean diff column in period lengths defined by threshold
         # subset = data.loc[:, col].copy()
         subset = data.loc[:, col]
+
+        # For large data, flag the runs in a single compiled pass
+        if numba_exists and subset.shape[0] >= NUMBA_MIN_ROWS:
+            flag = np.empty(subset.shape, dtype=bool, order="F")
+            _unresponsive_runs(np.asfortranarray(subset.to_numpy(dtype=float)), threshold, flag)
+            flag = pd.DataFrame(flag, index=subset.index, columns=subset.columns)
+            return flag[col[0]] if to_series else flag
+
+        # Get boolean value of the difference in successive time steps is not equal to zero, and take the
+        # rolling sum of the boolean diff column in period lengths defined by threshold
         flag = subset.diff(axis=0).ne(0).rolling(threshold - 1).sum()
 
         # Create boolean series that is True if rolling sum is zero
         flag = flag == 0
 
-        # Need to flag preceding `threshold` values as well
-        flag = flag | np.any([flag.shift(-1 - i, axis=0) for i in range(threshold - 1)], axis=0)
+        # Need to flag preceding `threshold` values as well, which is a forward-looking rolling max
+        # over the reversed flags; `min_periods=1` keeps the trailing values from being flagged
+        flag = (
+            flag.astype(np.uint8)
+            .iloc[::-1]
+            .rolling(threshold, min_periods=1)
+            .max()
+            .iloc[::-1]
+            .astype(bool)
+        )
 
         # Return back a pd.Series if one was provided, else a pd.DataFrame
         return flag[col[0]] if to_series else flag
     elif data_pl is not None:
-        flag = data_pl
-        # Get boolean value of the difference in successive time steps is not equal to zero, and take the
-        # rolling sum of the boolean diff column in period lengths defined by threshold
+        # Get boolean value of the difference in successive time steps is not equal to zero, take the
+        # rolling sum of the boolean diff column in period lengths defined by threshold, and flag
+        # where that sum is zero. The preceding `threshold` values are then flagged with a
+        # forward-looking rolling max over the reversed flags, where `min_samples=1` keeps the
+        # trailing values from being flagged. All stages are chained in a single expression so
+        # that polars can plan the full computation at once.
         if col is None:
-            col = sorted(list(flag.collect_schema().keys()))
-        
-        flag = flag.select(pl.col(col).diff().ne(0).fill_null(True)\
-                               .cast(pl.Int64).rolling_sum(window_size=threshold-1))
-        
-        # Create boolean series that is True if rolling sum is zero 
-        flag = flag.select(pl.all().eq(0).fill_null(False))
+            col = sorted(list(data_pl.collect_schema().keys()))
+
+        # For large data, flag the runs in a single compiled pass. Otherwise the flags stay lazy, so
+        # only the row count is computed up front, which doesn't need any of the column values
+        if numba_exists and data_pl.select(pl.len()).collect().item() >= NUMBA_MIN_ROWS:
+            x = data_pl.select(col).collect().to_numpy(order="fortran").astype(float, copy=False)
+            flag = np.empty(x.shape, dtype=bool, order="F")
+            _unresponsive_runs(x, threshold, flag)
+            return pl.from_numpy(flag, schema=col).lazy()
+
+        expr = (
+            pl.col(col)
+            .diff()
+            .ne(0)
+            .fill_null(True)
+            .cast(pl.UInt16)
+            .rolling_sum(window_size=threshold - 1)
+            .eq(0)
+            .fill_null(False)
+            .cast(pl.UInt8)
+            .reverse()
+            .rolling_max(window_size=threshold, min_samples=1)
+            .reverse()
+            .cast(pl.Boolean)
+        )
+        return data_pl.select(expr)
+    else:
+        raise TypeError("Either data_pl or data_pd must be passed.")
 
-        # Need to flag preceding `threshold` values as well
-        # NOTE: original implementation (first line) labels all trailing values as unresponsive sensor values, just because they reduce to nan with shift operator and nan equates to True
-        # flag = flag.select([(pl.col(c) | pl.any_horizontal([pl.col(c).shift(-1 - i).fill_null(True).alias(str(i)) for i in range(threshold - 1)])).alias(c) for c in col])
-        # flag = flag.select([(pl.col(c) | pl.any_horizontal([pl.col(c).shift(-1 - i).fill_null(False).alias(str(i)) for i in range(threshold - 1)])).alias(c) for c in col])
-        
-        flag_func = lambda c: flag.select((pl.col(c) | pl.any_horizontal([pl.col(c).shift(-1 - i).fill_null(False).alias(str(i)) for i in range(threshold - 1)])).alias(c)) 
-        
-        # # debug
-        # flag2 = subset.collect().to_pandas().diff(axis=0).ne(0).rolling(threshold - 1).sum()
-        # flag2 = flag2 == 0
-        # flag2 = flag2 | np.any([flag2.shift(-1 - i, axis=0).fillna(False) for i in range(threshold - 1)], axis=0)
-        # flag = flag.collect().to_pandas()
+def _cluster_std_range_flag(
+    data: pl.LazyFrame,
+    feat_type: str,
+    turbine_ids: np.ndarray,
+    cluster_mask: np.ndarray,
+    threshold: float,
+) -> pl.LazyFrame:
+    """Flag time stamps for which each asset's measurement is outside of the threshold number of
+    standard deviations from the mean across its cluster of correlated assets.
 
-        # Return back a pd.Series if one was provided, else a pd.DataFrame
-        # return flag.collect().to_pandas()
-        # expr = [pl.all().diff().ne(0).fill_null(True)\
-        #                .cast(pl.Int64).rolling_sum(window_size=threshold-1)\
-        #                .eq(0).fill_null(False),
-        #         [(pl.col(c) | pl.any_horizontal([pl.col(c).shift(-1 - i).fill_null(False).alias(str(i)) for i in range(threshold - 1)])).alias(c) for c in col]]
-        return flag_func
-        # return expr
+    Args:
+        data (:obj:`polars.LazyFrame`): data frame containing a `{feat_type}_{asset_id}` column for
+            each asset.
+        feat_type (:obj:`str`): feature type prefix of the columns to be flagged.
+        turbine_ids (:obj:`numpy.ndarray`): asset IDs of the K columns to be flagged.
+        cluster_mask (:obj:`numpy.ndarray`): K x K boolean array, where row t is True for each asset
+            in the cluster of asset t.
+        threshold (:obj:`float`): multiplicative factor on the standard deviation of the cluster.
+
+    Returns:
+        :obj:`polars.LazyFrame`: LazyFrame with boolean entries for each of the `feat_type` columns.
+    """
+    cols = [f"{feat_type}_{tid}" for tid in turbine_ids]
+    X = data.select(cols).collect().to_numpy().astype(float, copy=False)
+
+    # Compute the count, sum, and sum of squares of each cluster's valid values for every time
+    # stamp at once, where column t of each product is the reduction over asset t's cluster
+    valid = ~np.isnan(X)
+    X = np.where(valid, X, 0.0)
+    cluster_mask = cluster_mask.T.astype(float)
+    n = valid.astype(float) @ cluster_mask
+    sums = X @ cluster_mask
+    sq_sums = (X**2) @ cluster_mask
+
+    # Clusters with fewer than two valid values have an undefined standard deviation, and are
+    # not flagged, as NaN comparisons are always False
+    with np.errstate(divide="ignore", invalid="ignore"):
+        data_mean = sums / n
+        data_var = np.maximum(sq_sums - n * data_mean**2, 0.0) / (n - 1)
+        data_std = np.sqrt(data_var) * threshold
+    X[~valid] = np.nan
+    flag = (X <= data_mean - data_std) | (X >= data_mean + data_std)
+    return pl.from_numpy(flag, schema=cols).lazy()
+
+
+def _feature_type_std_range_flag(
+    data: pl.LazyFrame,
+    feat_type: str,
+    corr_df: dict[str, pl.DataFrame] | None,
+    r2_threshold: float,
+    min_correlated_assets: int,
+    threshold: float,
+) -> pl.LazyFrame:
+    """Flag time stamps for which each asset's `feat_type` measurement is outside of the threshold
+    number of standard deviations from the mean across its cluster of correlated assets. See
+    :py:func:`std_range_flag` for the argument descriptions.
+
+    Returns:
+        :obj:`polars.LazyFrame`: LazyFrame with boolean entries for each of the `feat_type` columns.
+    """
+    # Create correlation matrix between different assets, and store it in `corr_df` so that
+    # repeated calls with the same data can reuse it
+    if corr_df is None or feat_type not in corr_df:
+        cdf = asset_correlation_matrix_pl(data, feat_type)
+        if corr_df is not None:
+            corr_df[feat_type] = cdf
     else:
-        raise TypeError("Either data_pl or data_pd must be passed.")
+        cdf = corr_df[feat_type]
+
+    turbine_ids = np.array(cdf.columns)
+    corr = cdf.to_numpy()
+    # Sort the correlated values according to the highest value, with nans at the end.
+    # rows = turbine index, columns = order of correlation from highest to lowest
+    ix_sort = (-corr).argsort(axis=1)
+
+    # Each turbine's cluster is all turbines above the correlation threshold, which is extended by
+    # the next most correlated turbines to have `min_correlated_assets`
+    cluster_mask = corr > r2_threshold
+    for t in range(turbine_ids.size):
+        n_missing = min_correlated_assets - cluster_mask[t].sum()
+        if n_missing > 0:
+            candidates = ix_sort[t][~cluster_mask[t, ix_sort[t]]]
+            cluster_mask[t, candidates[:n_missing]] = True
+
+    return _cluster_std_range_flag(data, feat_type, turbine_ids, cluster_mask, threshold)
 
-def _single_turbine_std_range_flag(data, sort_df, corr_df, feat_type, tid, t, r2_threshold, threshold, min_correlated_assets, save_dir, chunk):
-    turbine_ids = np.array(corr_df.columns)
-    cluster_turbines = turbine_ids[[i for i, v in enumerate(corr_df.row(t)) if v > r2_threshold]] 
-    if len(cluster_turbines) < min_correlated_assets:
-        cluster_turbines = np.concatenate(
-            [cluster_turbines, 
-                    sort_df.loc[tid, ~sort_df.loc[tid].isin(cluster_turbines)].values[:min_correlated_assets-len(cluster_turbines)]])
-    
-    corr_features = [pl.col(f"{feat_type}_{corr_tid}") for corr_tid in cluster_turbines]
-    
-    logging.info(f"Defining mean/stddev over correlated turbines for chunk {chunk}, feature type {feat_type}, asset {tid}. Using RAM {virtual_memory().percent}%.")
-    data = data.select(corr_features)\
-               .with_columns(pl.mean_horizontal(corr_features).alias(f"mean_over_assets"), 
-                             (pl.concat_list(corr_features).list.std(ddof=1) * threshold).alias(f"std_over_assets"))
-    
-    logging.info(f"Defining lower/upper bounds for chunk {chunk}, feature type {feat_type}, asset {tid}. Using RAM {virtual_memory().percent}%.")
-    data = data.select(pl.col(f"{feat_type}_{tid}"), 
-                       (pl.col("mean_over_assets") - pl.col("std_over_assets")).alias("lower_bound"), 
-                       (pl.col("mean_over_assets") + pl.col("std_over_assets")).alias("upper_bound"))
-    
-    logging.info(f"Returning stddev filter for chunk {chunk}, feature type {feat_type}, asset {tid}. Using RAM {virtual_memory().percent}%.")
-    
-    # return data.select(~pl.col(f"{feat_type}_{tid}").is_between(lower_bound=pl.col("mean_over_assets") - pl.col("std_over_assets"), 
-    #                                                              upper_bound=pl.col("mean_over_assets") + pl.col("std_over_assets"), closed="none") \
-    #             .alias(f"{feat_type}_{tid}"))
-    return data.select(~pl.col(f"{feat_type}_{tid}").is_between(lower_bound=pl.col("lower_bound"), 
-                                                                 upper_bound=pl.col("upper_bound"), closed="none") \
-                .alias(f"{feat_type}_{tid}"))
 
 def std_range_flag(
     data_pd: pd.DataFrame | pd.Series | None = None,
     data_pl: pl.LazyFrame | None = None,
     threshold: float | list[float] = 2.0,
     col: list[str] | None = None,
-    over: str = Literal["time", "asset"],
+    over: Literal["time", "asset"] = "time",
     feature_types: list[str] | None = None,
     r2_threshold: float | None = None,
     min_correlated_assets: int = None,
@@ -216,6 +408,10 @@ def std_range_flag(
             if it's a ``pd.Series``, or the list of multiplicative factors on the standard deviation for
             each column in :py:attr:`col`. If the same factor is applied to each column, then pass the single
             value, otherwise, it must be the same length as :py:attr:`col` and :py:attr:`upper`.
+        corr_df (:obj:`dict[str, polars.DataFrame]`): asset correlation matrix of each feature type,
+            used when :py:attr:`over` is "asset". Any missing feature types are computed and added
+            to the dictionary, so the same dictionary can be passed to later calls on the same data.
+            Defaults to None.
 
     Returns:
         :obj:`pandas.Series` | `pandas.DataFrame`: Series or DataFrame (depending on :py:attr:`data` type) with
@@ -236,9 +432,11 @@ def std_range_flag(
         if over == "time":
             # subset = data.loc[:, col].copy()
             subset = data.loc[:, col]
-            data_mean = np.nanmean(subset.values, axis=0)
-            data_std = np.nanstd(subset.values, ddof=1, axis=0) * np.array(threshold)
+            values = subset.to_numpy(dtype=float)
+            data_mean = np.nanmean(values, axis=0)
+            data_std = np.nanstd(values, ddof=1, axis=0) * np.array(threshold, dtype=float)
             flag = subset.le(data_mean - data_std) | subset.ge(data_mean + data_std)
+            flag = flag.astype(np.bool_)
         else:
             # TODO 
             pass
@@ -251,58 +449,43 @@ def std_range_flag(
             col = sorted(list(data.collect_schema().keys()))
             
         if over == "time":
-            subset = data.select(col)
-            data_mean = pl.all().mean()
-            data_std =  pl.all().std(ddof=1) * threshold
-            flag = subset.select(pl.all().le(data_mean - data_std) \
-                                            | pl.all().ge(data_mean + data_std))
+            threshold, *_ = convert_args_to_lists(len(col), threshold)
+            if len(col) != len(threshold):
+                raise ValueError("The inputs to `col` and `threshold` must be the same length.")
+
+            flag = []
+            for c, t in zip(col, threshold):
+                data_mean = pl.col(c).mean()
+                data_std = pl.col(c).std(ddof=1) * t
+                flag.append(pl.col(c).le(data_mean - data_std) | pl.col(c).ge(data_mean + data_std))
+            flag = data.select(flag)
         else:
-            # Create correlation matrix between different assets
-            if False:
-                flag = []
-                for feat_type in feature_types:
-                    if corr_df is None:
-                        cdf = asset_correlation_matrix_pl(data_pl, feat_type)
-                    else:
-                        cdf = corr_df[feat_type]
-                    turbine_ids = np.array(cdf.columns)
-                    # Sort the correlated values according to the highest value, with nans at the end.
-                    ix_sort = (-cdf.to_numpy()).argsort(axis=1)
-                    # rows = turbine_id, columns = order of correlation from highest to lowest
-                    sort_df = pd.DataFrame(turbine_ids[ix_sort], index=turbine_ids)
-                    executor = ProcessPoolExecutor(mp_context=mp.get_context("spawn"), max_workers=int(os.environ.get("MAX_WORKERS", mp.cpu_count())))
-                    with executor as ex:
-                        if ex is not None:
-                            for t, tid in enumerate(turbine_ids):
-                                flag.append(ex.submit(_single_turbine_std_range_flag, data, sort_df, cdf, feat_type, tid, t, r2_threshold, threshold, min_correlated_assets, save_dir, chunk))
-                        
-                    flag = [f.result() for f in flag]
-                        
-            else:
-                flag = []
-                for feat_type in feature_types:
-                    if corr_df is None:
-                        cdf = asset_correlation_matrix_pl(data_pl, feat_type)
-                    else:
-                        cdf = corr_df[feat_type]
-
-                    turbine_ids = np.array(cdf.columns)
-                    # Sort the correlated values according to the highest value, with nans at the end.
-                    ix_sort = (-cdf.to_numpy()).argsort(axis=1)
-                    # rows = turbine_id, columns = order of correlation from highest to lowest
-                    sort_df = pd.DataFrame(turbine_ids[ix_sort], index=turbine_ids)
-                    for t, tid in enumerate(turbine_ids):
-                        res = _single_turbine_std_range_flag(data, sort_df, cdf, feat_type, tid, t, r2_threshold, threshold, min_correlated_assets, save_dir, chunk)
-                        flag.append(res)
-                    
-            logging.info(f"Started combining stddev flags for all feature types and assets for chunk {chunk}. Using RAM {virtual_memory().percent}%.")
-            flag = pl.concat(flag, how="horizontal")
-            logging.info(f"Finished combining stddev flags for all feature types and assets for chunk {chunk}. Using RAM {virtual_memory().percent}%.")
+            # Collect all of the feature type columns in a single query, so that the correlation and
+            # flagging of each feature type reuse the same in-memory data
+            data = data.select(cs.starts_with(*feature_types)).collect().lazy()
+
+            # Each feature type is flagged independently, so they are run concurrently, where the
+            # numpy matrix products release the GIL
+            flag_func = partial(
+                _feature_type_std_range_flag,
+                data,
+                corr_df=corr_df,
+                r2_threshold=r2_threshold,
+                min_correlated_assets=min_correlated_assets,
+                threshold=threshold,
+            )
+            max_workers = max(1, min(len(feature_types), os.cpu_count() or 1))
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                flag = list(ex.map(flag_func, feature_types))
+
+            logging.info(f"Started combining stddev flags for all feature types and assets for chunk {chunk}.")
+            flag = pl.concat(flag, how="horizontal") if flag else pl.LazyFrame()
+            logging.info(f"Finished combining stddev flags for all feature types and assets for chunk {chunk}.")
         
         # flag[flag == None] = False
-        logging.info(f"Started filling nulls and casting types for all feature types and assets for chunk {chunk}. Using RAM {virtual_memory().percent}%.")
-        flag = flag.select(pl.all().fill_null(False).cast(bool))
-        logging.info(f"Finished filling nulls and casting types for all feature types and assets for chunk {chunk}. Using RAM {virtual_memory().percent}%.")
+        logging.info(f"Started filling nulls and casting types for all feature types and assets for chunk {chunk}.")
+        flag = flag.select(pl.all().fill_null(False).cast(pl.Boolean))
+        logging.info(f"Finished filling nulls and casting types for all feature types and assets for chunk {chunk}.")
         return flag
     else:
         raise TypeError("Either data_pl or data_pd must be passed.")
@@ -336,8 +519,28 @@ def window_range_flag(
     Returns:
         :obj:`pandas.Series`: Series with boolean entries.
     """
-    flag = window_col.between(window_start, window_end) & ~value_col.between(value_min, value_max)
-    return flag
+    # Series that aren't aligned, or that use pandas' nullable types, need pandas' index alignment
+    # and missing value handling
+    if not window_col.index.equals(value_col.index) or not all(
+        isinstance(s.dtype, np.dtype) for s in (window_col, value_col)
+    ):
+        return window_col.between(window_start, window_end) & ~value_col.between(
+            value_min, value_max
+        )
+
+    # Evaluate the inclusive range checks in a single pass, where NaN values are outside the range
+    flag = ne.evaluate(
+        "(w >= ws) & (w <= we) & ~((v >= vmin) & (v <= vmax))",
+        local_dict={
+            "w": window_col.to_numpy(),
+            "ws": window_start,
+            "we": window_end,
+            "v": value_col.to_numpy(),
+            "vmin": value_min,
+            "vmax": value_max,
+        },
+    )
+    return pd.Series(flag, index=window_col.index)
 
 
 # @series_method(data_cols=["bin_col", "value_col"])
@@ -386,63 +589,101 @@ def bin_filter(
         )
 
     if data_pd is not None:
-        bin_col = data_pd.loc[:, bin_col].copy()
-        value_col = data_pd.loc[:, value_col].copy()
-        
+        bin_col = data_pd[bin_col].to_numpy()
+        value_col = data_pd[value_col]
+
         # Set bin min and max values if not passed to function
         if bin_min is None:
-            bin_min = np.min(bin_col.values)
+            bin_min = np.min(bin_col)
         if bin_max is None:
-            bin_max = np.max(bin_col.values)
+            bin_max = np.max(bin_col)
 
         # Define bin edges
         bin_edges = np.arange(bin_min, bin_max, bin_width)
 
-        # Ensure the last bin edge value is bin_max
-        bin_edges = np.unique(np.clip(np.append(bin_edges, bin_max), bin_min, bin_max))
-
-        # Bin the data and recreate the comparison data as a multi-column data frame
-        which_bin_col = np.digitize(bin_col, bin_edges, right=True) # bins[i-1] < x <= bins[i]
-
-        # Create the flag values as a matrix with each column being the timestamp's binned value,
-        # e.g., all columns values are NaN if the data point is not in that bin
-        flag_vals = (
-            value_col.to_frame().set_index(pd.Series(which_bin_col, name="bin"), append=True).unstack()
-        )
-        drop = [i for i, el in enumerate(flag_vals.columns.names) if el != "bin"]
-        flag_vals.columns = flag_vals.columns.droplevel(drop).rename(None)
-
-        # Create a False array as default, so flags are set to True
-        flag_df = pd.DataFrame(np.zeros_like(flag_vals, dtype=bool), index=flag_vals.index, columns=flag_vals.columns)
-
-        # Get center of binned data
-        if center_type == "median":
-            center = np.nanmedian(flag_vals.values, axis=0)
+        # Ensure the last bin edge value is bin_max, where the sorted edges only need bin_max appended
+        # after dropping any floating point overshoot of the final edge
+        if bin_edges.size == 0 or bin_edges[-1] < bin_max:
+            bin_edges = np.concatenate((bin_edges, [bin_max]))
         else:
-            center = np.nanmean(flag_vals.values, axis=0)
-        center = pd.DataFrame(
-            np.full(flag_vals.shape, center),
-            index=flag_vals.index,
-            columns=flag_vals.columns,
+            bin_edges[-1] = bin_max
+
+        # Bin the data, such that bins[i-1] < x <= bins[i]. Bin edges are equally spaced, so the bin
+        # index is computed directly, with NaN and values above bin_max being assigned to the last bin
+        n_bins = len(bin_edges)
+        in_range = bin_col <= bin_max
+        which_bin_col = np.full(bin_col.shape, n_bins)
+        which_bin_col[in_range] = np.clip(
+            np.ceil((bin_col[in_range] - bin_min) / bin_width), 0, n_bins - 1
         )
 
-        # Define threshold of data flag
-        if threshold_type == "std":
-            deviation = np.nanstd(flag_vals.values, ddof=1, axis=0) * threshold
-        elif threshold_type == "scalar":
-            deviation = threshold
-        else:  # median absolute deviation (mad)
-            deviation = np.nanmedian(np.abs(flag_vals.values - center), axis=0) * threshold
-
-        # Perform flagging depending on specfied direction
-        if direction in ("above", "all"):
-            flag_df |= flag_vals > center + deviation
-        if direction in ("below", "all"):
-            flag_df |= flag_vals < center - deviation
-
-        # Get all instances where the value is True, and reset any values outside the bin limits
-        flag_vals = pd.Series(np.nanmax(flag_df, axis=1), index=flag_df.index, dtype="bool")
-        flag_vals.loc[(bin_col <= bin_min) | (bin_col > bin_max)] = False
+        values = value_col.to_numpy(dtype=float)
+        above = direction in ("above", "all")
+        below = direction in ("below", "all")
+
+        # For large data, compute the bin statistics and flags in a single compiled pass when they
+        # don't require a median
+        if (
+            numba_exists
+            and center_type == "mean"
+            and threshold_type != "mad"
+            and values.size >= NUMBA_MIN_ROWS
+        ):
+            flag_vals, center = _bin_flag(
+                values,
+                which_bin_col,
+                n_bins + 1,
+                threshold,
+                threshold_type == "std",
+                above,
+                below,
+                get_num_threads(),
+            )
+        else:
+            # Compute the statistics of each bin directly from the valid values and their bin ids,
+            # rather than creating a sparse matrix of each timestamp's binned value
+            valid = ~np.isnan(values)
+            valid_values = values[valid]
+            labels = which_bin_col[valid]
+            bins = np.arange(n_bins + 1)
+            count = np.bincount(labels, minlength=n_bins + 1)
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Get center of binned data
+                if center_type == "median":
+                    center = ndimage.median(valid_values, labels=labels, index=bins)
+                else:
+                    center = ndimage.mean(valid_values, labels=labels, index=bins)
+                center[count == 0] = np.nan
+
+                # Define threshold of data flag
+                if threshold_type == "std":
+                    variance = ndimage.variance(valid_values, labels=labels, index=bins)
+                    deviation = np.sqrt(variance * count / (count - 1)) * threshold
+                elif threshold_type == "scalar":
+                    deviation = np.full(n_bins + 1, threshold)
+                else:  # median absolute deviation (mad)
+                    abs_deviation = np.abs(valid_values - center[labels])
+                    deviation = ndimage.median(abs_deviation, labels=labels, index=bins) * threshold
+
+            # Perform flagging depending on specfied direction, comparing each value to its bin
+            center_vals = center[which_bin_col]
+            deviation_vals = deviation[which_bin_col]
+            flag_vals = np.zeros(values.shape, dtype=bool)
+            if above:
+                flag_vals |= values > center_vals + deviation_vals
+            if below:
+                flag_vals |= values < center_vals - deviation_vals
+
+        # Reset any values outside the bin limits
+        flag_vals[(bin_col <= bin_min) | (bin_col > bin_max)] = False
+        flag_vals = pd.Series(flag_vals, index=value_col.index, dtype="bool")
+
+        # The centers are only stored as float32 after flagging, so that the comparisons use the
+        # full precision of the data
+        if return_center:
+            present = np.unique(which_bin_col)
+            center = pd.DataFrame([center[present].astype(np.float32)], columns=present)
     else:
         # data_pl = data_pl.filter(pl.col(value_col).is_not_null())
         # Set bin min and max values if not passed to function
@@ -454,59 +695,77 @@ def bin_filter(
         # Define bin edges
         bin_edges = np.arange(bin_min, bin_max, bin_width)
         
-        # Ensure the last bin edge value is bin_max
-        bin_edges = np.unique(np.clip(np.append(bin_edges, bin_max), bin_min, bin_max))
-
-        # Bin the data and recreate the comparison data as a multi-column data frame
-        which_bin_col = data_pl.select(pl.col(bin_col)).collect().to_series()\
-                               .cut(bin_edges, labels=[str(i) for i in np.arange(1+len(bin_edges))])\
-                               .cast(str).str.to_integer().to_numpy().astype(int)
+        # Ensure the last bin edge value is bin_max, where the sorted edges only need bin_max appended
+        # after dropping any floating point overshoot of the final edge
+        if bin_edges.size == 0 or bin_edges[-1] < bin_max:
+            bin_edges = np.concatenate((bin_edges, [bin_max]))
+        else:
+            bin_edges[-1] = bin_max
+
+        # Bin the data, such that bins[i-1] < x <= bins[i]. Bin edges are equally spaced, so the bin
+        # index is computed directly, with null, NaN, and values above bin_max being assigned to
+        # the last bin
+        n_bins = len(bin_edges)
+        which_bin_col = (
+            pl.when(pl.col(bin_col) <= bin_max)
+            .then(((pl.col(bin_col) - bin_min) / bin_width).ceil().clip(0, n_bins - 1))
+            .otherwise(pl.lit(n_bins))
+            .cast(pl.Int32)
+            .alias("bin")
+        )
 
-        which_bin_col[data_pl.with_row_index().filter(pl.col(bin_col).is_null()).select("index").collect().to_numpy().flatten()] = len(bin_edges)
-        
-        # Create the flag values as a matrix with each column being the timestamp's binned value,
-        # e.g., all columns values are NaN if the data point is not in that bin
-        flag_vals = data_pl\
-                           .select(pl.col(value_col))\
-                           .with_columns(bin=which_bin_col)\
-                           .with_row_index()\
-                           .collect().pivot("bin", index="index")\
-                           .select([pl.col(str(col)) for col in sorted(set(which_bin_col))])
-
-        # Create a False array as default, so flags are set to True
-        # flag_df = pd.DataFrame(np.zeros_like(flag_vals, dtype=bool), index=flag_vals.index)
+        # Compute the statistics of each bin with a group by on the bin id, and join them back to
+        # each timestamp, rather than creating a sparse matrix of each timestamp's binned value
+        df = data_pl.lazy().select(
+            pl.col(value_col), pl.col(bin_col).alias("values"), which_bin_col
+        )
 
         # Get center of binned data
         if center_type == "median":
-            center = flag_vals.select(pl.all().median())
+            center_expr = pl.col(value_col).median()
         else:
-            center = flag_vals.select(pl.all().mean())
-         
+            center_expr = pl.col(value_col).mean()
+
         # Define threshold of data flag
         if threshold_type == "std":
-            deviation = flag_vals.select(pl.all().std(ddof=1) * threshold)
+            deviation_expr = pl.col(value_col).std(ddof=1) * threshold
         elif threshold_type == "scalar":
-            deviation = pl.DataFrame({col: threshold for col in flag_vals.collect_schema().names()})
+            deviation_expr = pl.lit(threshold)
         else:  # median absolute deviation (mad)
-            deviation = flag_vals.select([pl.col(c) - center[c] for c in flag_vals.collect_schema().names()])\
-                                 .select(pl.all().abs().median() * threshold)
-        
+            deviation_expr = (pl.col(value_col) - center_expr).abs().median() * threshold
+
+        stats = df.group_by("bin").agg(
+            center_expr.alias("center"),
+            deviation_expr.alias("deviation"),
+        )
+
         # Perform flagging depending on specfied direction
+        above = pl.col(value_col) > pl.col("center") + pl.col("deviation")
+        below = pl.col(value_col) < pl.col("center") - pl.col("deviation")
         if direction == "all":
-            flag_vals.select([(pl.col(c) > center[c] + deviation[c]) | (pl.col(c) < center[c] - deviation[c]) for c in flag_vals.collect_schema().names()])
+            flag_expr = above | below
         elif direction == "below":
-            flag_vals = flag_vals.select([pl.col(c) < center[c] - deviation[c] for c in flag_vals.collect_schema().names()])
-        elif direction == "above":
-            flag_vals.select([pl.col(c) > center[c] + deviation[c] for c in flag_vals.collect_schema().names()])
-        
-        # Get all instances where the value is True, and reset any values outside the bin limits
-        flag_vals = flag_vals.fill_null(False).select(pl.max_horizontal(pl.all()).alias(bin_col))
-        flag_vals = pl.concat([flag_vals, 
-                               data_pl.select(pl.col(bin_col).alias("values")).collect()], how="horizontal")\
-                      .select(pl.when((pl.col("values") <= bin_min) | (pl.col("values") > bin_max))\
-                                .then(pl.lit(False))\
-                                .otherwise(pl.col(bin_col)).alias(bin_col))
-            
+            flag_expr = below
+        else:
+            flag_expr = above
+
+        # Reset any values outside the bin limits
+        flag_vals = (
+            df.join(stats, on="bin", how="left", maintain_order="left")
+            .select(
+                pl.when((pl.col("values") <= bin_min) | (pl.col("values") > bin_max))
+                .then(pl.lit(False))
+                .otherwise(flag_expr.fill_null(False))
+                .cast(pl.Boolean)
+                .alias(bin_col)
+            )
+            .collect()
+        )
+
+        if return_center:
+            center = stats.select("bin", pl.col("center").cast(pl.Float32)).sort("bin").collect()
+            center = pl.DataFrame({str(b): [c] for b, c in center.iter_rows()})
+
     if return_center:
         return flag_vals, center
     else:
@@ -536,34 +795,39 @@ def cluster_mahalanobis_2d(
     Returns:
         :obj:`pandas.Series(bool)`: Array-like object with boolean entries.
     """
-    data = data.loc[:, [data_col1, data_col2]].copy()
-    kmeans = KMeans(n_clusters=n_clusters).fit(data)
+    data = data.loc[:, [data_col1, data_col2]]
+    X = data.to_numpy(dtype=float)
+    kmeans = MiniBatchKMeans(
+        n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=0
+    ).fit(X)
 
     # Define empty flag of 'False' values with indices matching value_col
-    flag = pd.Series(index=data.index, data=False)
+    flag = np.zeros(X.shape[0], dtype=bool)
+
+    # Sort the data by cluster once, so that each cluster's indices are a contiguous split
+    ix_sort = np.argsort(kmeans.labels_, kind="stable")
+    ix_split = np.flatnonzero(np.diff(kmeans.labels_[ix_sort])) + 1
 
     # Loop through clusters and flag data that fall outside a threshold distance from cluster center
-    for i in range(n_clusters):
+    for ix_cluster in np.split(ix_sort, ix_split):
         # Extract data for cluster
-        clust_sub = kmeans.labels_ == i
-        cluster = data.loc[clust_sub]
+        cluster = X[ix_cluster]
 
-        # Cluster centroid
-        centroid = kmeans.cluster_centers_[i]
+        # Cluster centroid, using the mean of the cluster, as the mini-batch centers are only an
+        # approximation of it
+        centroid = cluster.mean(axis=0)
 
         # Cluster covariance and inverse covariance
-        covmx = cluster.cov()
-        invcovmx = sp.linalg.inv(covmx)
-
-        # Compute mahalnobis distance of each point in cluster
-        mahalanobis_dist = cluster.apply(
-            lambda r: sp.spatial.distance.mahalanobis(r.values, centroid, invcovmx), axis=1
-        )
+        covmx = np.cov(cluster, rowvar=False)
+        invcovmx = np.linalg.inv(covmx)
 
-        # Flag data outside the distance threshold
-        flag_bin = mahalanobis_dist > dist_thresh
+        # Compute the squared mahalnobis distance of each point in cluster as a single quadratic
+        # form, which is compared to the squared threshold to avoid the square root
+        delta = cluster - centroid
+        mahalanobis_dist_sq = np.einsum("ni,ij,nj->n", delta, invcovmx, delta)
 
-        # Record flags in final flag column
-        flag.loc[flag_bin.index] = flag_bin
+        # Flag data outside the distance threshold, and record flags in final flag column
+        flag[ix_cluster] = mahalanobis_dist_sq > dist_thresh**2
 
+    flag = pd.Series(flag, index=data.index)
     return flag
@@ -2,14 +2,16 @@
 This module provides methods for filling in null data with interpolated (imputed) values.
 """
 
-from copy import deepcopy
+import os
+from typing import Callable
+from functools import partial, lru_cache
+from itertools import chain
 from concurrent.futures import ProcessPoolExecutor
 import multiprocessing
 import numpy as np
 import pandas as pd
 import polars as pl
 import polars.selectors as cs
-from numpy.polynomial import Polynomial
 import re
 
 import logging 
@@ -22,10 +24,340 @@ mpi_exists = False
 #     mpi_exists = True
 # except:
 #     print("No MPI available on system.")
+
+numba_exists = False
+try:
+    from numba import njit
+    numba_exists = True
+except ModuleNotFoundError:
+    pass
     
 import numexpr as ne
 
-ne.set_num_threads(ne.detect_number_of_cores())
+# Floating point type of the arrays used for the asset correlations and imputation fits, which can be
+# set to `np.float64` when the full precision is needed. The imputed data keep the input's type.
+WORK_DTYPE = np.float32
+
+
+if numba_exists:
+    @njit(cache=True)
+    def _walk_neighbors(target: np.ndarray, neighbors: np.ndarray) -> np.ndarray:
+        """Fills the NaN values of :py:attr:`target` with a linear fit on each row of
+        :py:attr:`neighbors`, in order, until there are no NaN values or neighbors remaining. Each
+        fit uses all of the rows where the original target and the neighbor are both finite.
+
+        Args:
+            target(:obj:`numpy.ndarray`): the target asset's data.
+            neighbors(:obj:`numpy.ndarray`): 2-D array of the reference data of each neighbor, in
+                the order they should be used, aligned to :py:attr:`target`.
+
+        Returns:
+            :obj:`numpy.ndarray`: Copy of :py:attr:`target` with the NaN values imputed where possible.
+        """
+        imputed = target.copy()
+        ix_nan = np.isnan(target)
+        n_nan = ix_nan.sum()
+        for k in range(neighbors.shape[0]):
+            if n_nan == 0:
+                break
+            x = neighbors[k]
+
+            # Closed form linear regression on the centered values
+            n = 0
+            x_sum = 0.0
+            y_sum = 0.0
+            for i in range(x.size):
+                if np.isfinite(x[i]) and np.isfinite(target[i]):
+                    n += 1
+                    x_sum += x[i]
+                    y_sum += target[i]
+            if n == 0:
+                # Not enough data to create a curve fit
+                break
+            x_mean = x_sum / n
+            y_mean = y_sum / n
+            sxx = 0.0
+            sxy = 0.0
+            for i in range(x.size):
+                if np.isfinite(x[i]) and np.isfinite(target[i]):
+                    dx = x[i] - x_mean
+                    sxx += dx * dx
+                    sxy += dx * (target[i] - y_mean)
+            if sxx == 0.0:
+                # The fit is undefined for a constant neighbor, so it can't fill any values
+                continue
+            slope = sxy / sxx
+            intercept = y_mean - slope * x_mean
+
+            for i in range(x.size):
+                if ix_nan[i] and np.isfinite(x[i]):
+                    imputed[i] = intercept + x[i] * slope
+                    if not np.isnan(imputed[i]):
+                        ix_nan[i] = False
+                        n_nan -= 1
+        return imputed
+
+
+def _impute_linear_neighbors(target: np.ndarray, neighbors: np.ndarray) -> np.ndarray:
+    """Fills the NaN values of :py:attr:`target` with a linear fit on each row of
+    :py:attr:`neighbors`, in order, until there are no NaN values or neighbors remaining. Each fit
+    is independent of the others, so all of the fits are computed at once, and the compiled
+    :py:func:`_walk_neighbors` is used instead when numba is available.
+
+    Args:
+        target(:obj:`numpy.ndarray`): the target asset's data.
+        neighbors(:obj:`numpy.ndarray`): 2-D array of the reference data of each neighbor, in the
+            order they should be used, aligned to :py:attr:`target`.
+
+    Returns:
+        :obj:`numpy.ndarray`: Copy of :py:attr:`target` with the NaN values imputed where possible.
+    """
+    if numba_exists:
+        return _walk_neighbors(target, neighbors)
+
+    # Fit each neighbor on the rows where the neighbor and the original target are both finite
+    valid = np.isfinite(neighbors) & np.isfinite(target)
+    n = valid.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = np.where(valid, neighbors, 0.0).sum(axis=1) / n
+        y_mean = np.where(valid, target, 0.0).sum(axis=1) / n
+        dx = np.where(valid, neighbors - x_mean[:, None], 0.0)
+        dy = np.where(valid, target - y_mean[:, None], 0.0)
+        slope = np.einsum("ij,ij->i", dx, dy) / np.einsum("ij,ij->i", dx, dx)
+    intercept = y_mean - slope * x_mean
+
+    # Only the remaining NaN values are updated after each fill, rather than checking all of the data
+    imputed = target.copy()
+    ix_nan = np.isnan(target)
+    for k in range(neighbors.shape[0]):
+        if not ix_nan.any() or n[k] == 0:
+            break
+        ix_fill = ix_nan & np.isfinite(neighbors[k])
+        imputed[ix_fill] = intercept[k] + neighbors[k, ix_fill] * slope[k]
+        ix_nan[ix_fill] = np.isnan(imputed[ix_fill])
+    return imputed
+
+
+def _sort_neighbors(corr: np.ndarray, r2_threshold: float) -> np.ndarray:
+    """Sorts each row of the correlation matrix from the highest to the lowest correlation, with
+    NaN values at the end. The neighbors are only used while their correlation is above
+    :py:attr:`r2_threshold`, so only those are fully sorted, and the rest follow in an arbitrary
+    order after them. Equal correlations are kept in column order, as with a stable sort.
+
+    Args:
+        corr(:obj:`numpy.ndarray`): the square asset correlation matrix.
+        r2_threshold(:obj:`float`): the correlation threshold for a neighboring asset to be used.
+
+    Returns:
+        :obj:`numpy.ndarray`: The column indices of each row, in order of decreasing correlation.
+    """
+    corr = -corr
+    k = int((corr < -r2_threshold).sum(axis=1).max(initial=0))
+    if k == 0 or k >= corr.shape[1] - 1:
+        return corr.argsort(axis=1, kind="stable")
+
+    # Partition the k highest correlations of each row to the front, then sort only those, where
+    # they are put back in column order first so that ties stay in column order
+    ix_sort = np.argpartition(corr, k - 1, axis=1)
+    ix_top = np.sort(ix_sort[:, :k], axis=1)
+    ix_sort[:, :k] = np.take_along_axis(
+        ix_top, np.take_along_axis(corr, ix_top, axis=1).argsort(axis=1, kind="stable"), axis=1
+    )
+    return ix_sort
+
+
+def _impute_neighbors(
+    target: np.ndarray, neighbors: np.ndarray, method: str, degree: int, target_id: str
+) -> np.ndarray:
+    """Fills the NaN values of :py:attr:`target` using the fit on each row of :py:attr:`neighbors`,
+    in order, until there are no NaN values or neighbors remaining.
+
+    Args:
+        target(:obj:`numpy.ndarray`): the target asset's data.
+        neighbors(:obj:`numpy.ndarray`): 2-D array of the reference data of each neighbor, in the
+            order they should be used, aligned to :py:attr:`target`.
+        method(:obj:`str`): The imputation method, should be one of "linear" or "polynomial".
+        degree(:obj:`int`): The polynomial degree.
+        target_id(:obj:`str`): the target asset's id, for reporting any failed fits.
+
+    Returns:
+        :obj:`numpy.ndarray`: Copy of :py:attr:`target` with the NaN values imputed where possible.
+    """
+    if method == "linear" or (method == "polynomial" and degree == 1):
+        return _impute_linear_neighbors(target, neighbors)
+    if method != "polynomial":
+        raise NotImplementedError(
+            "Only 'linear' (1-degree polynomial) and 'polynomial' fits are implemented at this time."
+        )
+
+    # The target's masks are computed once, and only the remaining NaN values are updated after
+    # each fill
+    imputed = target.copy()
+    ix_nan = np.isnan(target)
+    ix_finite = np.isfinite(target)
+    for reference in neighbors:
+        if not ix_nan.any():
+            break
+        # Get the imputed data based on the correlation-based next nearest neighbor
+        ix_reference = np.isfinite(reference)
+        if not (ix_reg := ix_finite & ix_reference).any():
+            print(
+                f"ValueError was raised while trying to impute {target_id}: Not enough data to"
+                " create a curve fit."
+            )
+            break
+        coefficients = _polynomial_coefficients(
+            reference[ix_reg].astype(WORK_DTYPE), target[ix_reg].astype(WORK_DTYPE), degree
+        )
+
+        # Fill any NaN values with available imputed values
+        ix_fill = ix_nan & ix_reference
+        imputed[ix_fill] = _evaluate_polynomial(reference[ix_fill], coefficients)
+        ix_nan[ix_fill] = np.isnan(imputed[ix_fill])
+    return imputed
+
+
+def asset_positions(index: pd.MultiIndex, asset_id_col: str) -> dict[str, np.ndarray]:
+    """Map each asset in a MultiIndex to the integer positions of its rows, so that each asset's data
+    can be selected with ``iloc`` rather than a boolean comparison over the whole index.
+
+    Args:
+        index(:obj:`pandas.MultiIndex`): index such as that of :py:attr:`PlantData.scada` that uses
+            a timestamp and asset_id for its levels.
+        asset_id_col(:obj:`str`): the name of the asset_id level of :py:attr:`index`.
+
+    Returns:
+        :obj:`dict[str, numpy.ndarray]`: The sorted row positions of each asset_id.
+    """
+    codes, uniques = pd.factorize(index.get_level_values(asset_id_col))
+    order = np.argsort(codes, kind="stable")
+    splits = np.cumsum(np.bincount(codes, minlength=uniques.size))[:-1]
+    return dict(zip(uniques, np.split(order, splits)))
+
+
+def _horner_expression(degree: int) -> str:
+    """Create the numexpr expression of a polynomial of `x` in Horner form, with the coefficients
+    `c0`, `c1`, ..., in order of increasing degree.
+
+    Args:
+        degree(:obj:`int`): the polynomial degree.
+
+    Returns:
+        :obj:`str`: The polynomial expression, e.g., "c0 + x * (c1 + x * (c2))" for degree 2.
+    """
+    expression = f"c{degree}"
+    for i in range(degree - 1, -1, -1):
+        expression = f"c{i} + x * ({expression})"
+    return expression
+
+
+def _evaluate_linear(x: np.ndarray, coefficients: np.ndarray) -> np.ndarray:
+    """Evaluates the 1-degree polynomial, which is a single multiply-add that doesn't need numexpr."""
+    return coefficients[0] + coefficients[1] * x
+
+
+@lru_cache(maxsize=None)
+def _polynomial_evaluator(degree: int) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    """Creates the evaluation function for a polynomial of :py:attr:`degree` once, so that each fit
+    only has to look it up.
+
+    Args:
+        degree(:obj:`int`): the polynomial degree.
+
+    Returns:
+        :obj:`Callable`: A function of the values and the coefficients, in order of increasing degree,
+            that returns the value of the polynomial at each value.
+    """
+    if degree == 1:
+        return _evaluate_linear
+
+    expression = _horner_expression(degree)
+    names = [f"c{i}" for i in range(degree + 1)]
+
+    def evaluate(x: np.ndarray, coefficients: np.ndarray) -> np.ndarray:
+        local_dict = dict(zip(names, coefficients))
+        local_dict["x"] = x
+        return ne.evaluate(expression, local_dict=local_dict)
+
+    return evaluate
+
+
+def _evaluate_polynomial(x: np.ndarray, coefficients: np.ndarray) -> np.ndarray:
+    """Evaluates the polynomial in Horner form, using a single fused numexpr expression for degrees
+    above 1.
+
+    Args:
+        x(:obj:`numpy.ndarray`): the values to evaluate the polynomial at.
+        coefficients(:obj:`numpy.ndarray`): The polynomial coefficients, in order of increasing degree.
+
+    Returns:
+        :obj:`numpy.ndarray`: The value of the polynomial at each of :py:attr:`x`.
+    """
+    return _polynomial_evaluator(coefficients.size - 1)(x, coefficients)
+
+
+def _polynomial_coefficients(x: np.ndarray, y: np.ndarray, degree: int) -> np.ndarray:
+    """Least squares fit of a polynomial of y on x, computed directly from the arrays rather than
+    through a ``numpy.polynomial.Polynomial`` object.
+
+    Args:
+        x(:obj:`numpy.ndarray`): the finite reference values.
+        y(:obj:`numpy.ndarray`): the finite target values.
+        degree(:obj:`int`): the polynomial degree.
+
+    Returns:
+        :obj:`numpy.ndarray`: The polynomial coefficients, in order of increasing degree.
+    """
+    if degree == 1:
+        # Closed form simple linear regression, using the centered values to avoid cancellation
+        x_mean = x.mean()
+        y_mean = y.mean()
+        dx = x - x_mean
+        slope = np.dot(dx, y - y_mean) / np.dot(dx, dx)
+        return np.array([y_mean - slope * x_mean, slope])
+    vander = np.vander(x, degree + 1, increasing=True)
+    return np.linalg.lstsq(vander, y, rcond=None)[0]
+
+
+def _impute_data_arrays(
+    target: np.ndarray, reference: np.ndarray, method: str = "linear", degree: int = 1
+) -> np.ndarray:
+    """Array version of :py:func:`impute_data` for target and reference data that are already
+    aligned, which skips the pandas merging and indexing.
+
+    Args:
+        target(:obj:`numpy.ndarray`): the data with NaN values to be imputed.
+        reference(:obj:`numpy.ndarray`): the data to be used in imputation.
+        method(:obj:`str`): The imputation method, should be one of "linear" or "polynomial", by
+            default "linear".
+        degree(:obj:`int`): The polynomial degree, by default 1.
+
+    Returns:
+        :obj:`numpy.ndarray`: Copy of :py:attr:`target` with NaN occurrences imputed where possible.
+    """
+    ix_reg = np.isfinite(target) & np.isfinite(reference)
+    if not ix_reg.any():
+        raise ValueError("Not enough data to create a curve fit.")
+
+    # Ensure old method call will work here
+    if method == "linear":
+        method = "polynomial"
+        degree = 1
+    if method == "polynomial":
+        coefficients = _polynomial_coefficients(
+            reference[ix_reg].astype(WORK_DTYPE), target[ix_reg].astype(WORK_DTYPE), degree
+        )
+    else:
+        raise NotImplementedError(
+            "Only 'linear' (1-degree polynomial) and 'polynomial' fits are implemented at this time."
+        )
+
+    imputed = np.array(target, dtype=float)
+    ix_impute = np.isnan(target) & np.isfinite(reference)
+    if ix_impute.any():
+        imputed[ix_impute] = _evaluate_polynomial(reference[ix_impute], coefficients)
+    return imputed
+
 
 def impute_data(
     target_col: str,
@@ -61,7 +393,7 @@ def impute_data(
     Returns:
         :obj:`pandas.Series`: Copy of target_data_col series with NaN occurrences imputed where possible.
     """
-    final_col_name = deepcopy(target_col)
+    final_col_name = target_col
     if data is None:
         if any(not isinstance(x, pd.DataFrame) for x in (target_data, reference_data)):
             raise TypeError(
@@ -95,7 +427,7 @@ def impute_data(
         # If the input and reference series are names the same, adjust their names to match the
         # result from merging
         if target_col == reference_col:
-            final_col_name = deepcopy(target_col)
+            final_col_name = target_col
             target_col = target_col + "_x"  # Match the merged column name
             reference_col = reference_col + "_y"  # Match the merged column name
 
@@ -105,26 +437,31 @@ def impute_data(
         raise ValueError("The input `reference_col` is not a column of `data`.")
 
     data = data.loc[:, [reference_col, target_col]]
-    data_reg = data.dropna()
-    if data_reg.empty:
-        raise ValueError("Not enough data to create a curve fit.")
+    target = data[target_col].to_numpy(dtype=float)
+    imputed = _impute_data_arrays(target, data[reference_col].to_numpy(dtype=float), method, degree)
+    if not np.isnan(target).any():
+        return data.loc[:, target_col].rename(final_col_name)
+    return pd.Series(imputed, index=data.index, name=final_col_name)
 
-    # Ensure old method call will work here
-    if method == "linear":
-        method = "polynomial"
-        degree = 1
-    if method == "polynomial":
-        curve_fit = Polynomial.fit(data_reg[reference_col], data_reg[target_col], degree)
-    else:
-        raise NotImplementedError(
-            "Only 'linear' (1-degree polynomial) and 'polynomial' fits are implemented at this time."
-        )
 
-    imputed = data.loc[
-        (data[target_col].isnull() & np.isfinite(data[reference_col])), [reference_col]
-    ]
-    data.loc[imputed.index, target_col] = curve_fit(imputed[reference_col])
-    return data.loc[:, target_col].rename(final_col_name)
+_impute_worker = None
+
+
+def _init_impute_worker(impute_func, impute_kwargs: dict):
+    """Stores the imputation function with the arguments shared by all assets in each worker
+    process of :py:func:`impute_all_assets_by_correlation`.
+    """
+    global _impute_worker
+    _impute_worker = partial(impute_func, **impute_kwargs)
+    ne.set_num_threads(1)
+
+
+def _impute_target_ids(target_ids: list) -> list[tuple]:
+    """Imputes each of the :py:attr:`target_ids` with the function stored by
+    :py:func:`_init_impute_worker`.
+    """
+    return [(target_id, _impute_worker(target_id=target_id)) for target_id in target_ids]
+
 
 def impute_all_assets_by_correlation(
     data_pd: pd.DataFrame | None,
@@ -165,7 +502,9 @@ def impute_all_assets_by_correlation(
         degree(:obj:`int`): The polynomial degree, i.e. linear is a 1 degree polynomial, by default 1
 
     Returns:
-        :obj:`pandas.Series`: The imputation results
+        :obj:`pandas.Series` | `polars.LazyFrame`: The imputation results, as a Series named
+            "imputed_<impute_col>" aligned to :py:attr:`data_pd`, or as a LazyFrame of the updated
+            :py:attr:`data_pl` saved to :py:attr:`save_path`, or None if there were no updates.
 
     """
 
@@ -179,195 +518,209 @@ def impute_all_assets_by_correlation(
         corr_df = asset_correlation_matrix_pd(data_pd, impute_col)
 
         # Sort the correlated values according to the highest value, with nans at the end.
-        ix_sort = (-corr_df.fillna(-2)).values.argsort(axis=1)
+        ix_sort = _sort_neighbors(corr_df.fillna(-2).to_numpy(), r2_threshold)
         sort_df = pd.DataFrame(corr_df.columns.to_numpy()[ix_sort], index=corr_df.index)
         data = data_pd
-        impute_func = impute_target_id_pd
+        impute_func = partial(
+            impute_target_id_pd, positions=asset_positions(data_pd.index, asset_id_col)
+        )
     elif data_pl is not None:
         # impute_df = None
 
-        # Create correlation matrix between different assets
-        # set diagonal values to Null
-        corr_df = asset_correlation_matrix_pl(data_pl, impute_col)\
-            .with_columns(pl.when(pl.all() != 1.0).then(pl.all())) 
+        # Create correlation matrix between different assets, and set the diagonal values to null,
+        # without dropping any perfect correlations between different assets
+        corr_df = asset_correlation_matrix_pl(data_pl, impute_col)
+        corr_df = corr_df.with_columns(
+            pl.when(pl.int_range(pl.len()) != i).then(pl.col(tid)).alias(tid)
+            for i, tid in enumerate(corr_df.columns)
+        )
 
         # Sort the correlated values according to the highest value, with nans at the end.
-        ix_sort = (-corr_df.fill_null(-2).to_numpy()).argsort(axis=1)
+        ix_sort = _sort_neighbors(corr_df.fill_null(-2).to_numpy(), r2_threshold)
         sort_df = pd.DataFrame(np.array(corr_df.columns)[ix_sort], index=corr_df.columns)
         data = data_pl #.collect().lazy()
-        impute_func = impute_target_id_pl
+        impute_func = partial(
+            impute_target_id_pl,
+            dense=_dense_asset_arrays(data_pl, corr_df.columns, impute_col, reference_col),
+        )
 
     # Loop over the assets and impute missing data
-    if multiprocessor is not None:
-        # if multiprocessor == "mpi" and mpi_exists:
-        #     executor = MPICommExecutor(MPI.COMM_WORLD, root=0)
-        # else:  # "cf" case
-        max_workers = multiprocessing.cpu_count()
-        executor = ProcessPoolExecutor(max_workers=max_workers,
-                                            mp_context=multiprocessing.get_context("spawn"))
-        with executor as ex:
-            if ex is not None:
-                futures = {target_id: ex.submit(impute_func, 
-                                            data=data,
-                                            corr_df=corr_df,
-                                            sort_df=sort_df,
-                                            r2_threshold=r2_threshold,
-                                            asset_id_col=asset_id_col,
-                                            impute_df=data, impute_col=impute_col, reference_col=reference_col,
-                                            target_id=target_id, method=method, degree=degree) 
-                                            for target_id in corr_df.columns}
-                # data_cols = []
-                any_updates = False
-                for tid, fut in futures.items():
-                    res = fut.result()
-                    if res is None:
-                        # there are no nans
-                        continue
-                    any_updates = True
-                    _, sub_df = res
-                    data.update(sub_df.rename({impute_col: f"{impute_col}_{tid}"}), on="time")\
-                        .collect().write_parquet(save_path.replace(".parquet", f"_{impute_col}.parquet"), statistics=False)
-                    data = pl.scan_parquet(save_path.replace(".parquet", f"_{impute_col}.parquet"))
-                    # data_cols.append(sub_df.select(impute_col).rename({impute_col: f"{impute_col}_{tid}"}))
-    else:
-        # data_cols = []
-        any_updates = False
-        for target_id in corr_df.columns:
-            
-            res = impute_func(data=data,
-                                corr_df=corr_df,
-                                sort_df=sort_df,
-                                r2_threshold=r2_threshold,
-                                asset_id_col=asset_id_col,
-                                impute_df=data, impute_col=impute_col, reference_col=reference_col,
-                                target_id=target_id, method=method, degree=degree)
-            if res is None:
-                # there are no nans
-                continue
-            any_updates = True
-            _, sub_df = res
-            data.update(sub_df.rename({impute_col: f"{impute_col}_{target_id}"}), on="time")\
-                .collect().write_parquet(save_path.replace(".parquet", f"_{impute_col}.parquet"), statistics=False)
-            data = pl.scan_parquet(save_path.replace(".parquet", f"_{impute_col}.parquet"))
-            # data_cols.append(sub_df.select(impute_col).rename({impute_col: f"{impute_col}_{target_id}"}))
+    impute_kwargs = dict(
+        data=data,
+        corr_df=corr_df,
+        sort_df=sort_df,
+        r2_threshold=r2_threshold,
+        asset_id_col=asset_id_col,
+        impute_df=data,
+        impute_col=impute_col,
+        reference_col=reference_col,
+        method=method,
+        degree=degree,
+    )
+    # Each worker process runs numexpr with a single thread to avoid oversubscribing the cores,
+    # otherwise numexpr's threads are limited for the duration of the imputation
+    n_threads = 1 if multiprocessor is not None else min(8, os.cpu_count() or 1)
+    previous_threads = ne.set_num_threads(n_threads)
+    try:
+        # Processes are only started when there are assets to impute
+        if multiprocessor is not None and len(corr_df.columns) > 0:
+            # if multiprocessor == "mpi" and mpi_exists:
+            #     executor = MPICommExecutor(MPI.COMM_WORLD, root=0)
+            # else:  # "cf" case
+            # Send the shared inputs to each worker once, and split the assets into one chunk per
+            # worker, rather than sending all of the inputs with each asset
+            target_ids = list(corr_df.columns)
+            max_workers = min(multiprocessing.cpu_count(), len(target_ids))
+            chunks = np.array_split(np.arange(len(target_ids)), max_workers)
+            chunks = [[target_ids[i] for i in ix] for ix in chunks]
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_impute_worker,
+                initargs=(impute_func, impute_kwargs),
+            )
+            with executor as ex:
+                results = dict(chain.from_iterable(ex.map(_impute_target_ids, chunks)))
+        else:
+            impute_target_id = partial(impute_func, **impute_kwargs)
+            results = {tid: impute_target_id(target_id=tid) for tid in corr_df.columns}
+    finally:
+        ne.set_num_threads(previous_threads)
+
+    # Combine the imputed rows of all the assets into a single Series aligned to the input data
+    if data_pd is not None:
+        imputed = data_pd[impute_col].to_numpy(dtype=float, copy=True)
+        for res in results.values():
+            if res is not None:
+                ix_target, sub_df = res
+                imputed[ix_target] = sub_df[impute_col].to_numpy()
+        return pd.Series(imputed, index=data_pd.index, name=f"imputed_{impute_col}")
+
+    # Combine the imputed columns of all the assets, so that the data is only updated and saved once
+    data_cols = []
+    for tid, res in results.items():
+        if res is None:
+            # there are no nans
+            continue
+        _, sub_df = res
+        if not data_cols:
+            data_cols.append(sub_df.select("time"))
+        data_cols.append(sub_df.select(pl.col(impute_col).alias(f"{impute_col}_{tid}")))
 
-    # Return the results with the impute_col renamed with a leading "imputed_" for clarity
-    # return impute_df.rename(columns={c: f"imputed_{c}" for c in impute_df.columns})
-    # return pl.concat([data.select("time")] + data_cols, how="horizontal")
-    # if data_cols:
-    #     return pl.concat([data.select("time")] + data_cols, how="horizontal")
-    # else:
-    #     return None
-    if any_updates:
-        return data
-    else:
+    # Return None if there were no updates
+    if not data_cols:
         return None
 
-def impute_target_id_pl(data, corr_df, sort_df, r2_threshold, asset_id_col, impute_df, impute_col, reference_col, target_id, method, degree):
-    logging.info(f"Imputing feature {impute_col} for asset {target_id}")
-    # If there are no NaN values, then skip the asset altogether, otherwise
-    # keep track of the number we need to continue checking for
-    ix_target = cs.ends_with(f"_{target_id}").alias(impute_col)
-    target_df = data.select("time", ix_target).collect().lazy()
-    sub_df = target_df.clone()
+    save_path = save_path.replace(".parquet", f"_{impute_col}.parquet")
+    data.update(pl.concat(data_cols, how="horizontal"), on="time")\
+        .collect().write_parquet(save_path, statistics=False)
+    return pl.scan_parquet(save_path)
 
-    ix_nan = sub_df.select(pl.col(impute_col).is_null()).collect()
-    any_nans = ix_nan.select(pl.col(impute_col).any()).item()
-    if not any_nans:
-        return
+def _dense_asset_arrays(
+    data: pl.LazyFrame, asset_ids: list[str], impute_col: str, reference_col: str
+) -> tuple[pl.Series, np.ndarray, np.ndarray]:
+    """Collects the imputation and reference data of every asset in a single query, so that each
+    asset's imputation only needs to index the arrays.
 
-    # Get the correlation-based neareast neighbor and data
-    id_sort_neighbor = 0
-    id_neighbor = sort_df.loc[target_id, id_sort_neighbor]
-    r2_neighbor = corr_df[id_neighbor][corr_df.columns.index(target_id)]
-    
-    # If the R2 value is too low, then move on to the next asset
-    if r2_neighbor <= r2_threshold:
-        return
+    Args:
+        data(:obj:`polars.LazyFrame`): input data with a "time" column, and a "<col>_<asset_id>"
+            column for each asset's :py:attr:`impute_col` and :py:attr:`reference_col` data.
+        asset_ids(:obj:`list[str]`): the asset ids, in the order of the correlation matrix.
+        impute_col(:obj:`str`): the name of the data to be imputed.
+        reference_col(:obj:`str`): the name of the data to be used in imputation.
 
-    num_neighbors = corr_df.shape[0] - 1
-    while (any_nans) and (num_neighbors > 0) and (r2_neighbor > r2_threshold):
-        # Get the imputed data based on the correlation-based next nearest neighbor
-        reference_df = data.select("time", cs.ends_with(f"_{id_neighbor}").alias(impute_col))
-        try:
-            imputed_data = impute_data(
-                # target_data=data.xs(target_id, level=1).loc[:, [impute_col]],
-                target_data=target_df.select(impute_col).collect().to_pandas(),
-                target_col=impute_col,
-                # reference_data=data.xs(id_neighbor, level=1).loc[:, [reference_col]],
-                reference_data=reference_df.select(reference_col).collect().to_pandas(),
-                reference_col=reference_col,
-                method=method,
-                degree=degree,
-            )
-        except ValueError as e:
-            print(f"ValueError was raised while trying to impute {target_id}: {e}")
-            break
-        
-        # Fill any NaN/None/Null values with available imputed values
-        sub_df = sub_df.with_columns(pl.when(ix_nan).then(imputed_data.values).otherwise(pl.col(impute_col)).alias(impute_col))
-        # imputed_data contains nans instead of nulls
-        ix_nan = sub_df.select(pl.col(impute_col).is_nan()).collect()
-        any_nans = ix_nan.select(pl.col(impute_col).any()).item()
-        num_neighbors -= 1
-        id_sort_neighbor += 1
-        id_neighbor = sort_df.loc[target_id, id_sort_neighbor]
-        r2_neighbor = corr_df[id_neighbor][corr_df.columns.index(target_id)]
+    Returns:
+        tuple[:obj:`polars.Series`, :obj:`numpy.ndarray`, :obj:`numpy.ndarray`]: The time stamps,
+            and the imputation and reference data with a row for each asset, in float64 and
+            :py:data:`WORK_DTYPE`, respectively.
+    """
+    impute_names = [f"{impute_col}_{tid}" for tid in asset_ids]
+    reference_names = [f"{reference_col}_{tid}" for tid in asset_ids]
+    select_names = impute_names if reference_col == impute_col else impute_names + reference_names
+    df = data.select("time", pl.col(select_names).cast(pl.Float64)).collect()
+
+    impute_values = df.select(impute_names).to_numpy(order="fortran").T
+    reference_values = df.select(reference_names).to_numpy(order="fortran").T
+    return df["time"], impute_values, np.ascontiguousarray(reference_values, dtype=WORK_DTYPE)
 
-    return ix_target, sub_df.fill_nan(None)
 
-def impute_target_id_pd(data, corr_df, sort_df, r2_threshold, asset_id_col, impute_df, impute_col, reference_col, target_id, method, degree):
+def impute_target_id_pl(data, corr_df, sort_df, r2_threshold, asset_id_col, impute_df, impute_col, reference_col, target_id, method, degree, dense=None):
     logging.info(f"Imputing feature {impute_col} for asset {target_id}")
+    # Gather the correlation-based nearest neighbors, in order, until the R2 value is too low
+    ix_corr = corr_df.columns.index(target_id)
+    neighbors = []
+    for id_neighbor in sort_df.loc[target_id].iloc[: corr_df.shape[0] - 1]:
+        r2_neighbor = corr_df[id_neighbor][ix_corr]
+        if r2_neighbor is None or not r2_neighbor > r2_threshold:
+            break
+        neighbors.append(id_neighbor)
+    if not neighbors:
+        return
+
+    target_name = f"{impute_col}_{target_id}"
+    if dense is None:
+        # Collect the target and all of its usable neighbors' data in a single query
+        dense = _dense_asset_arrays(data, [target_id, *neighbors], impute_col, reference_col)
+        ix_corr = 0
+        ix_neighbors = np.arange(1, len(neighbors) + 1)
+    else:
+        ix_asset = {tid: i for i, tid in enumerate(corr_df.columns)}
+        ix_neighbors = [ix_asset[id_neighbor] for id_neighbor in neighbors]
+    times, impute_values, reference_values = dense
+
     # If there are no NaN values, then skip the asset altogether, otherwise
     # keep track of the number we need to continue checking for
-    ix_target = impute_df.index.get_level_values(1) == target_id
-    sub_df = impute_df.loc[ix_target, [impute_col]]
-    if (ix_nan := data.loc[ix_target, impute_col].isnull()).sum() == 0:
+    target = impute_values[ix_corr]
+    if not np.isnan(target).any():
         return
 
-    # Get the correlation-based neareast neighbor and data
-    id_sort_neighbor = 0
-    id_neighbor = sort_df.loc[target_id, id_sort_neighbor]
-    r2_neighbor = corr_df.loc[target_id, id_neighbor]
+    imputed = _impute_neighbors(target, reference_values[ix_neighbors], method, degree, target_id)
+    sub_df = pl.DataFrame({"time": times, impute_col: imputed}).fill_nan(None)
+    return pl.col(target_name).alias(impute_col), sub_df.lazy()
+
+def impute_target_id_pd(data, corr_df, sort_df, r2_threshold, asset_id_col, impute_df, impute_col, reference_col, target_id, method, degree, positions=None):
+    logging.info(f"Imputing feature {impute_col} for asset {target_id}")
+    if positions is None:
+        positions = asset_positions(data.index, asset_id_col)
 
-    # If the R2 value is too low, then move on to the next asset
-    if r2_neighbor <= r2_threshold:
+    # If there are no NaN values, then skip the asset altogether, otherwise
+    # keep track of the number we need to continue checking for
+    ix_target = positions[target_id]
+    sub_df = impute_df[[impute_col]].iloc[ix_target]
+    if (ix_nan := data[impute_col].iloc[ix_target].isnull()).sum() == 0:
         return
 
+    # If the R2 value of the correlation-based nearest neighbor is too low, then move on to the
+    # next asset
+    if corr_df.loc[target_id, sort_df.loc[target_id, 0]] <= r2_threshold:
+        return
+
+    # Gather the neighbors that meet the correlation threshold, with their data aligned to the
+    # target's timestamps
     num_neighbors = corr_df.shape[0] - 1
-    while (ix_nan.sum() > 0) & (num_neighbors > 0) & (r2_neighbor > r2_threshold):
-        # Get the imputed data based on the correlation-based next nearest neighbor
-        try:
-            imputed_data = impute_data(
-                # target_data=data.xs(target_id, level=1).loc[:, [impute_col]],
-                target_data=data.loc[
-                    data.index.get_level_values(1) == target_id, [impute_col]
-                ].droplevel(asset_id_col),
-                target_col=impute_col,
-                # reference_data=data.xs(id_neighbor, level=1).loc[:, [reference_col]],
-                reference_data=data.loc[
-                    data.index.get_level_values(1) == id_neighbor, [reference_col]
-                ].droplevel(asset_id_col),
-                reference_col=reference_col,
-                method=method,
-                degree=degree,
-            )
-        except ValueError as e:
-            print(f"ValueError was raised while trying to impute {target_id}: {e}")
+    neighbors = []
+    for id_neighbor in sort_df.loc[target_id].iloc[:num_neighbors]:
+        if not corr_df.loc[target_id, id_neighbor] > r2_threshold:
             break
-
-        # Fill any NaN values with available imputed values
-        sub_df = sub_df.where(
-            ~ix_nan, imputed_data.to_frame()
-        )
-
-        ix_nan = sub_df[impute_col].isnull()
-        num_neighbors -= 1
-        id_sort_neighbor += 1
-        id_neighbor = sort_df.loc[target_id, id_sort_neighbor]
-        r2_neighbor = corr_df.loc[target_id, id_neighbor]
-
-    return ix_target, sub_df 
+        neighbors.append(id_neighbor)
+
+    target_data = data[impute_col].iloc[ix_target].droplevel(asset_id_col)
+    references = np.empty((len(neighbors), target_data.size), dtype=WORK_DTYPE)
+    for k, id_neighbor in enumerate(neighbors):
+        reference = data[reference_col].iloc[positions[id_neighbor]].droplevel(asset_id_col)
+        if not reference.index.equals(target_data.index):
+            reference = reference.reindex(target_data.index)
+        references[k] = reference.to_numpy(dtype=WORK_DTYPE)
+
+    imputed = _impute_neighbors(
+        target_data.to_numpy(dtype=float), references, method, degree, target_id
+    )
+
+    # Fill any NaN values with available imputed values
+    values = sub_df[impute_col].to_numpy(copy=True)
+    np.copyto(values, imputed, where=ix_nan.to_numpy())
+    sub_df[impute_col] = values
+    return ix_target, sub_df
 
 def asset_correlation_matrix_pl(data: pl.LazyFrame, value_col: str) -> pd.DataFrame:
     """Create a correlation matrix on a MultiIndex `DataFrame` with time (or a different
@@ -387,14 +740,58 @@ def asset_correlation_matrix_pl(data: pl.LazyFrame, value_col: str) -> pd.DataFr
     #                         .drop("time").to_pandas().corr()
     cols = data.select(cs.starts_with(value_col)).collect_schema().names()
     n_cols = len(cols)
-    turbine_ids = [re.search(f"(?<={value_col}_)\\w+$", col).group(0) for col in cols]
-    corr_df = data.select([pl.corr(cols[c], cols[cc])\
-        .alias(f"{re.search(f"(?<={value_col}_)\\w+$", cols[c]).group(0)}CORR{re.search(f"(?<={value_col}_)\\w+$", cols[cc]).group(0)}") 
-        for c in range(n_cols) for cc in range(c, n_cols) if c != cc]).collect()
-    corr_df = pl.DataFrame(data={tid1: [(corr_df[f"{tid1}CORR{tid2}"][0] if f"{tid1}CORR{tid2}" in corr_df else corr_df[f"{tid2}CORR{tid1}"][0]) if tid1 != tid2 else 1.0 for tid2 in turbine_ids] for tid1 in turbine_ids}) 
-    
+
+    # Extract each column's asset id once, and name the correlations by their column indices
+    pattern = re.compile(f"(?<={re.escape(value_col)}_)\\w+$")
+    turbine_ids = [pattern.search(col).group(0) for col in cols]
+    pairs = [(c, cc) for c in range(n_cols) for cc in range(c + 1, n_cols)]
+    corr_row = ()
+    if pairs:
+        corr_exprs = [pl.corr(cols[c], cols[cc]).alias(f"{c}_{cc}") for c, cc in pairs]
+        corr_row = data.select(corr_exprs).collect().row(0)
+
+    corr = [[1.0] * n_cols for _ in range(n_cols)]
+    for (c, cc), value in zip(pairs, corr_row):
+        corr[c][cc] = corr[cc][c] = value
+    corr_df = pl.DataFrame(data={tid: corr[c] for c, tid in enumerate(turbine_ids)})
+
     return corr_df
 
+def _pairwise_corrcoef(values: np.ndarray, min_periods: int = 2) -> np.ndarray:
+    """Computes the Pearson correlation between each pair of columns of :py:attr:`values`, using
+    only the rows where both columns are finite, similar to ``pandas.DataFrame.corr``.
+
+    Args:
+        values(:obj:`numpy.ndarray`): 2-D array with a column for each asset.
+        min_periods(:obj:`int`): the minimum number of shared finite rows for a correlation to be
+            computed, otherwise it is NaN, by default 2.
+
+    Returns:
+        :obj:`numpy.ndarray`: The square correlation matrix.
+    """
+    valid = np.isfinite(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if valid.all():
+            if values.shape[0] < min_periods:
+                return np.full((values.shape[1], values.shape[1]), np.nan)
+            return np.atleast_2d(np.corrcoef(values, rowvar=False, dtype=values.dtype))
+
+        # Center each column to limit the cancellation in the sums, then compute the sums of each
+        # pair of columns over their shared finite rows with matrix products. The means are
+        # computed from the masked sums, as columns without any finite values have no mean.
+        w = valid.astype(values.dtype)
+        mean = np.where(valid, values, 0.0).sum(axis=0) / w.sum(axis=0)
+        x = np.where(valid, values - mean, 0.0)
+        n = w.T @ w
+        sx = x.T @ w
+        sxx = (x * x).T @ w
+        cov = x.T @ x - sx * sx.T / n
+        var = sxx - sx**2 / n
+        corr = cov / np.sqrt(var * var.T)
+    corr[n < min_periods] = np.nan
+    return corr
+
+
 def asset_correlation_matrix_pd(data: pd.DataFrame, value_col: str) -> pd.DataFrame:
     """Create a correlation matrix on a MultiIndex `DataFrame` with time (or a different
     alignment value) and asset_id values as its indices, respectively.
@@ -408,12 +805,12 @@ def asset_correlation_matrix_pd(data: pd.DataFrame, value_col: str) -> pd.DataFr
     Returns:
         :obj:`pandas.DataFrame`: Correlation matrix with <id_col> as index and column names
     """
-    corr_df = data.loc[:, [value_col]].unstack().corr(min_periods=2)
-    corr_df = corr_df.droplevel(0).droplevel(0, axis=1)  # drop the added axes
-    corr_df.index = corr_df.index.set_names(None)
-    corr_df.columns = corr_df.index.set_names(None)
-    np.fill_diagonal(corr_df.values, np.nan)
-    return corr_df
+    values = data.loc[:, value_col].unstack()
+    asset_ids = values.columns.set_names(None)
+    corr = _pairwise_corrcoef(values.to_numpy(dtype=WORK_DTYPE))
+    np.fill_diagonal(corr, np.nan)
+    return pd.DataFrame(corr, index=asset_ids, columns=asset_ids.copy())
+
 
 def impute_all_assets_by_correlation_sequential(
     data: pd.DataFrame,
@@ -454,20 +851,23 @@ def impute_all_assets_by_correlation_sequential(
         :obj:`pandas.Series`: The imputation results
 
     """
-    impute_df = data.loc[:, :].copy()
-
     # Create correlation matrix between different assets
     corr_df = asset_correlation_matrix_pd(data, impute_col)
 
     # Sort the correlated values according to the highest value, with nans at the end.
-    ix_sort = (-corr_df.fillna(-2)).values.argsort(axis=1)
+    ix_sort = _sort_neighbors(corr_df.fillna(-2).to_numpy(), r2_threshold)
     sort_df = pd.DataFrame(corr_df.columns.to_numpy()[ix_sort], index=corr_df.index)
+
+    # Find the rows of each asset once, rather than comparing the full index for every lookup
+    positions = asset_positions(data.index, asset_id_col)
+    imputed = data[impute_col].to_numpy(copy=True)
+
     # Loop over the assets and impute missing data
     for target_id in corr_df.columns:
         # If there are no NaN values, then skip the asset altogether, otherwise
         # keep track of the number we need to continue checking for
-        ix_target = impute_df.index.get_level_values(1) == target_id
-        if (ix_nan := data.loc[ix_target, impute_col].isnull()).sum() == 0:
+        ix_target = positions[target_id]
+        if (ix_nan := pd.isnull(imputed[ix_target])).sum() == 0:
             continue
 
         # Get the correlation-based neareast neighbor and data
@@ -484,25 +884,23 @@ def impute_all_assets_by_correlation_sequential(
             # Get the imputed data based on the correlation-based next nearest neighbor
             imputed_data = impute_data(
                 # target_data=data.xs(target_id, level=1).loc[:, [impute_col]],
-                target_data=data.loc[
-                    data.index.get_level_values(1) == target_id, [impute_col]
-                ].droplevel(asset_id_col),
+                target_data=data[[impute_col]].iloc[ix_target].droplevel(asset_id_col),
                 target_col=impute_col,
                 # reference_data=data.xs(id_neighbor, level=1).loc[:, [reference_col]],
-                reference_data=data.loc[
-                    data.index.get_level_values(1) == id_neighbor, [reference_col]
-                ].droplevel(asset_id_col),
+                reference_data=data[[reference_col]]
+                .iloc[positions[id_neighbor]]
+                .droplevel(asset_id_col),
                 reference_col=impute_col,
                 method=method,
                 degree=degree,
             )
 
             # Fill any NaN values with available imputed values
-            impute_df.loc[ix_target, [impute_col]] = impute_df.loc[ix_target, [impute_col]].where(
-                ~ix_nan, imputed_data.to_frame()
-            )
+            target_values = imputed[ix_target]
+            np.copyto(target_values, imputed_data.to_numpy(), where=ix_nan)
+            imputed[ix_target] = target_values
 
-            ix_nan = impute_df.loc[ix_target, impute_col].isnull()
+            ix_nan = pd.isnull(target_values)
             num_neighbors -= 1
             id_sort_neighbor += 1
             id_neighbor = sort_df.loc[target_id, id_sort_neighbor]
@@ -510,4 +908,4 @@ def impute_all_assets_by_correlation_sequential(
 
     # Return the results with the impute_col renamed with a leading "imputed_" for clarity
     # return impute_df.rename(columns={c: f"imputed_{c}" for c in impute_df.columns})
-    return impute_df[impute_col].rename(f"imputed_{impute_col}")
+    return pd.Series(imputed, index=data.index, name=f"imputed_{impute_col}")
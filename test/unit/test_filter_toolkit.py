@@ -1,10 +1,12 @@
 import unittest
+from unittest import mock
 
 import numpy as np
 import pandas as pd
+import polars as pl
 from numpy import testing as nptest
 
-from openoa.utils import filters
+from openoa.utils import filters, imputing
 
 
 class SimpleFilters(unittest.TestCase):
@@ -126,6 +128,38 @@ class SimpleFilters(unittest.TestCase):
         y_test = filters.unresponsive_flag(x, threshold=2)
         self.assertTrue(y.equals(y_test))
 
+    def test_unresponsive_flag_pl(self):
+        x = pl.LazyFrame(
+            {
+                "a": [-1, -1, -1, 2, 2, 2, 3, 4, 5, 1, 1, 1, 1, 3, 3],
+                "b": [-1, -2, -3, 2, 2, 2, 2, 3, 4, 6, 8, 1, 1, 1, 1],
+            }
+        )
+        y = np.array(
+            [
+                [True] * 6 + [False] * 3 + [True] * 4 + [False] * 2,
+                [False] * 3 + [True] * 4 + [False] * 4 + [True] * 4,
+            ]
+        ).T
+        y_test = filters.unresponsive_flag(data_pl=x, threshold=3)
+        self.assertTrue(isinstance(y_test, pl.LazyFrame))
+        nptest.assert_array_equal(y_test.collect().to_numpy(), y)
+
+    @unittest.skipUnless(filters.numba_exists, "numba is not installed")
+    def test_unresponsive_flag_numba(self):
+        x = pd.DataFrame(
+            {
+                "a": [-1, -1, -1, 2, 2, 2, 3, 4, 5, 1, 1, 1, 1, 3, 3],
+                "b": [-1, -2, -3, 2, 2, 2, 2, 3, 4, 6, 8, np.nan, np.nan, 1, 1],
+            }
+        )
+        y = filters.unresponsive_flag(x, threshold=3)
+        with mock.patch.object(filters, "NUMBA_MIN_ROWS", 1):
+            y_test = filters.unresponsive_flag(x, threshold=3)
+            y_test_pl = filters.unresponsive_flag(data_pl=pl.from_pandas(x).lazy(), threshold=3)
+        self.assertTrue(y.equals(y_test))
+        nptest.assert_array_equal(y_test_pl.collect().to_numpy(), y.to_numpy())
+
     def test_window_range_flag(self):
         x = pd.Series(np.array([-1, -1, -1, 1, 1, 1, -1]), name="data")
         window = pd.Series(np.array([1, 2, 3, 4, 5, 6, 7]), name="window")
@@ -133,12 +167,36 @@ class SimpleFilters(unittest.TestCase):
         y_test = filters.window_range_flag(window, 3, 8, x, -0.5, 1.5)
         self.assertTrue(y.equals(y_test))
 
+    def test_window_range_flag_unaligned(self):
+        window = pd.Series([1.0, 5.0, 6.0], index=[0, 1, 2])
+        x = pd.Series([-1.0, 1.0, -1.0], index=[2, 0, 1])
+        y_test = filters.window_range_flag(window, 3, 8, x, -0.5, 1.5)
+        nptest.assert_array_equal(y_test, [False, True, True])
+
+        # Missing values of nullable types are not flagged
+        window = pd.Series([1.0, 5.0, None, 6.0], dtype="Float64")
+        x = pd.Series([-1.0, None, -1.0, 1.0], dtype="Float64")
+        y_test = filters.window_range_flag(window, 3, 8, x, -0.5, 1.5)
+        nptest.assert_array_equal(y_test.fillna(False).astype(bool), [False, False, False, False])
+
+        # Missing values of numpy types are outside of the value range
+        window = pd.Series([1.0, 5.0, np.nan, 6.0])
+        x = pd.Series([-1.0, np.nan, -1.0, 1.0])
+        y_test = filters.window_range_flag(window, 3, 8, x, -0.5, 1.5)
+        nptest.assert_array_equal(y_test, [False, True, False, False])
+
     def test_std_range_flag(self):
         x = pd.Series(np.array([-1, -1, -1, 1, -1, -1, -1]), name="data")
-        y_test = filters.std_range_flag(x, 2)
+        y_test = filters.std_range_flag(x, threshold=2)
         y = pd.Series([False, False, False, True, False, False, False])
         nptest.assert_array_equal(y_test, y)
 
+    def test_std_range_flag_precision(self):
+        # The statistics keep the precision of the data, where the spread is lost in float32
+        x = pd.Series(1e6 + np.array([0.0, 0.04, 0.04, 0.04, 0.04]), name="data")
+        y_test = filters.std_range_flag(x, threshold=1)
+        nptest.assert_array_equal(y_test, [True, False, False, False, False])
+
     def test_std_range_flag_df(self):
         x = pd.DataFrame(
             [
@@ -152,7 +210,7 @@ class SimpleFilters(unittest.TestCase):
             ],
             columns=["a", "b", "c"],
         )
-        y_test = filters.std_range_flag(x, 2, col=["b", "c"])
+        y_test = filters.std_range_flag(x, threshold=2, col=["b", "c"])
         y = pd.DataFrame(
             [
                 [False, False],
@@ -167,6 +225,13 @@ class SimpleFilters(unittest.TestCase):
         )
         self.assertTrue(y.equals(y_test))
 
+        # Each column uses its own threshold
+        kwargs = dict(threshold=[2, 0.5], col=["b", "c"])
+        y_test = filters.std_range_flag(data_pl=pl.from_pandas(x).lazy(), **kwargs)
+        y = filters.std_range_flag(x, **kwargs)
+        self.assertTrue(y["c"].any())
+        nptest.assert_array_equal(y_test.collect().to_numpy(), y.to_numpy())
+
     def test_std_range_flag_errors(self):
         x = pd.DataFrame(
             [
@@ -181,16 +246,159 @@ class SimpleFilters(unittest.TestCase):
             columns=["a", "b", "c"],
         )
         with self.assertRaises(ValueError):
-            filters.std_range_flag(x, [2], col=["b", "c"])
+            filters.std_range_flag(x, threshold=[2], col=["b", "c"])
+
+        with self.assertRaises(ValueError):
+            filters.std_range_flag(data_pl=pl.from_pandas(x).lazy(), threshold=[2], col=["b", "c"])
+
+    def test_std_range_flag_asset(self):
+        rng = np.random.default_rng(1)
+        signal = rng.normal(size=30)
+        data = {}
+        for feat_type in ("ws", "power"):
+            for tid, noise in zip("abcd", (0.1, 0.2, 0.5, 3.0)):
+                values = signal + rng.normal(scale=noise, size=signal.size)
+                values[rng.choice(signal.size, 3, replace=False)] = np.nan
+                data[f"{feat_type}_{tid}"] = values
+        data["ws_b"][5] = 10
+        data_pl = pl.from_dict(data).fill_nan(None).lazy()
+        kwargs = dict(
+            data_pl=data_pl,
+            threshold=1.0,
+            over="asset",
+            feature_types=["ws", "power"],
+            r2_threshold=0.9,
+            min_correlated_assets=3,
+        )
+
+        # Flag each asset over its cluster of correlated assets, one asset at a time
+        expected = []
+        corr_df = {}
+        for feat_type in kwargs["feature_types"]:
+            corr = imputing.asset_correlation_matrix_pl(data_pl, feat_type)
+            corr_df[feat_type] = corr
+            turbine_ids = np.array(corr.columns)
+            ix_sort = (-corr.to_numpy()).argsort(axis=1)
+            for t, tid in enumerate(turbine_ids):
+                cluster = [c for c, v in zip(turbine_ids, corr.row(t)) if v > 0.9]
+                # Some of the assets need their clusters extended by the next most correlated asset
+                candidates = [c for c in turbine_ids[ix_sort[t]] if c not in cluster]
+                cluster += candidates[: 3 - len(cluster)]
+                cols = [pl.col(f"{feat_type}_{c}") for c in cluster]
+                value = pl.col(f"{feat_type}_{tid}")
+                mean = pl.mean_horizontal(cols)
+                std = pl.concat_list(cols).list.std(ddof=1)
+                expected.append(
+                    data_pl.select(
+                        (~value.is_between(mean - std, mean + std, closed="none")).fill_null(False)
+                    ).collect()
+                )
+        expected = pl.concat(expected, how="horizontal")
+        n_cluster = [(corr.to_numpy() > 0.9).sum(axis=1) for corr in corr_df.values()]
+        self.assertTrue((np.concatenate(n_cluster) < 3).any())
+        self.assertTrue(expected.to_numpy().any())
+
+        y_test = filters.std_range_flag(**kwargs).collect()
+        nptest.assert_array_equal(y_test.columns, expected.columns)
+        nptest.assert_array_equal(y_test.to_numpy(), expected.to_numpy())
+
+        # The correlation matrices are stored in, and reused from, the provided `corr_df`
+        cache = {}
+        y_test = filters.std_range_flag(**kwargs, corr_df=cache).collect()
+        self.assertEqual(sorted(cache), ["power", "ws"])
+        nptest.assert_array_equal(cache["ws"].to_numpy(), corr_df["ws"].to_numpy())
+        y_test = filters.std_range_flag(**kwargs, corr_df=cache).collect()
+        nptest.assert_array_equal(y_test.to_numpy(), expected.to_numpy())
+
+        # There is nothing to flag without any feature types
+        kwargs["feature_types"] = []
+        self.assertEqual(filters.std_range_flag(**kwargs).collect().shape, (0, 0))
 
     # TODO: Test more code paths in bin_filter
     def test_bin_filter(self):
         x_val = pd.Series(np.array([-1, -1, -1, -1, -1, 10, -1]))
         x_bin = pd.Series(np.array([1, 1.5, 2, 2.5, 3, 3.5, 4]))
-        flag = filters.bin_filter(x_bin, x_val, 3)
+        x = pd.DataFrame({"bin": x_bin, "value": x_val})
+        flag = filters.bin_filter("bin", "value", 3, data_pd=x)
         expected = pd.Series([False, False, False, False, False, True, False])
         nptest.assert_array_equal(flag, expected)
 
+    def test_bin_filter_direction(self):
+        x = pd.DataFrame(
+            {
+                "bin": [1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5],
+                "value": [-1, -1, -1, -1, -1, 10, -1, 2, np.nan, 2, 2, -5],
+            }
+        )
+        center = [-1, -1, 11 / 3, -1 / 3]
+        for threshold_type, threshold, direction, ix_flag in (
+            ("std", 1.0, "all", [5, 11]),
+            ("scalar", 3, "above", [5]),
+            ("scalar", 3, "below", [6, 11]),
+        ):
+            expected = np.zeros(x.shape[0], dtype=bool)
+            expected[ix_flag] = True
+            kwargs = dict(
+                threshold=threshold,
+                threshold_type=threshold_type,
+                direction=direction,
+                return_center=True,
+            )
+
+            y, y_center = filters.bin_filter("bin", "value", 2, data_pd=x, **kwargs)
+            nptest.assert_array_equal(y, expected)
+            self.assertEqual(y_center.columns.tolist(), [0, 1, 2, 3])
+            nptest.assert_array_almost_equal(y_center.to_numpy()[0], center)
+
+            y, y_center = filters.bin_filter(
+                "bin", "value", 2, data_pl=pl.from_pandas(x).lazy(), **kwargs
+            )
+            nptest.assert_array_equal(y["bin"].to_numpy(), expected)
+            self.assertEqual(y_center.columns, ["0", "1", "2", "3"])
+            nptest.assert_array_almost_equal(y_center.row(0), center)
+
+    def test_bin_filter_mad(self):
+        # Bins of identical values have no deviation from their median, so nothing is flagged
+        x = pd.DataFrame({"bin": [1.0, 1.2, 2.5], "value": [0.1, 0.1, 0.7]})
+        kwargs = dict(bin_min=0, center_type="median", threshold_type="mad")
+        y = filters.bin_filter("bin", "value", 1, data_pd=x, **kwargs)
+        nptest.assert_array_equal(y, [False, False, False])
+        y = filters.bin_filter("bin", "value", 1, data_pl=pl.from_pandas(x).lazy(), **kwargs)
+        nptest.assert_array_equal(y["bin"].to_numpy(), [False, False, False])
+
+    @unittest.skipUnless(filters.numba_exists, "numba is not installed")
+    def test_bin_filter_numba(self):
+        x = pd.DataFrame(
+            {
+                "bin": [1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5],
+                "value": [-1, -1, -1, -1, -1, 10, -1, 2, np.nan, 2, 2, -5],
+            }
+        )
+        for threshold_type, threshold, direction in (
+            ("std", 1.5, "all"),
+            ("scalar", 3, "above"),
+            ("scalar", 3, "below"),
+        ):
+            kwargs = dict(
+                threshold=threshold,
+                threshold_type=threshold_type,
+                direction=direction,
+                data_pd=x,
+                return_center=True,
+            )
+            y, center = filters.bin_filter("bin", "value", 2, **kwargs)
+            with mock.patch.object(filters, "NUMBA_MIN_ROWS", 1):
+                y_test, center_test = filters.bin_filter("bin", "value", 2, **kwargs)
+            self.assertTrue(y.equals(y_test))
+            nptest.assert_array_equal(center_test, center)
+
+        # Bins of identical values are not flagged without any deviation
+        x = pd.DataFrame({"bin": [1.0, 1.2, 2.5], "value": [0.1, 0.1, 0.7]})
+        kwargs = dict(bin_min=0, threshold=0, threshold_type="scalar", data_pd=x)
+        with mock.patch.object(filters, "NUMBA_MIN_ROWS", 1):
+            y_test = filters.bin_filter("bin", "value", 1, **kwargs)
+        nptest.assert_array_equal(y_test, [False, False, False])
+
     def test_cluster_mahalanobis_2d(self):
         col1 = pd.Series(np.array([1.0, 1.01, 1.001, 2.0, 2.01, 2.001, 2.0001]))
         col2 = pd.Series(np.array([3.0, 3.02, 3.001, 4.0, 4.01, 4.001, 5.0001]))
@@ -1,8 +1,13 @@
+import os
+import tempfile
+import warnings
 import unittest
+from unittest import mock
 from multiprocessing.sharedctypes import Value
 
 import numpy as np
 import pandas as pd
+import polars as pl
 from numpy import testing as nptest
 
 from openoa.utils import imputing
@@ -251,15 +256,79 @@ class SimpleFilters(unittest.TestCase):
 
     def test_asset_correlation_matrix(self):
         # Test 1, make sure a simple correlation of two assets works
-        y = imputing.asset_correlation_matrix(self.test_df, "data")
+        y = imputing.asset_correlation_matrix_pd(self.test_df, "data")
         nptest.assert_array_almost_equal(
             y, np.array([[np.nan, 0.970166], [0.970166, np.nan]]), decimal=4
         )
 
         # Test 2, if no overlapping data are present, make sure correlation matrix is all NaN
-        y2 = imputing.asset_correlation_matrix(self.test9_df, "data")
+        y2 = imputing.asset_correlation_matrix_pd(self.test9_df, "data")
         nptest.assert_array_equal(y2, np.array([[np.nan, np.nan], [np.nan, np.nan]]))
 
+        # Test 3, the polars version uses a column of each asset, and keeps the diagonal
+        data_pl = pl.from_pandas(self.test_df["data"].unstack().add_prefix("data_")).lazy()
+        y3 = imputing.asset_correlation_matrix_pl(data_pl, "data")
+        self.assertEqual(y3.columns, ["a", "b"])
+        nptest.assert_array_almost_equal(
+            y3.to_numpy(), np.array([[1.0, 0.970166], [0.970166, 1.0]]), decimal=4
+        )
+
+    def test_pairwise_corrcoef(self):
+        # Make sure the correlations match pandas over the shared finite values of each pair
+        rng = np.random.default_rng(1)
+        values = rng.normal(size=(20, 6))
+        values[:, 1] += values[:, 0]
+        values[rng.choice(20, 5, replace=False), 1] = np.nan
+        values[1:, 2] = np.nan  # Not enough shared values
+        values[:, 3] = 5.0  # Constant
+        values[:3, 3] = np.nan
+        values[:, 4] = np.nan  # No values
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            y_test = imputing._pairwise_corrcoef(values)
+        y = pd.DataFrame(values).corr(min_periods=2).to_numpy()
+        nptest.assert_array_almost_equal(y_test, y)
+
+        # All finite values use numpy's correlation directly
+        values = rng.normal(size=(20, 3))
+        y = pd.DataFrame(values).corr(min_periods=2).to_numpy()
+        nptest.assert_array_almost_equal(imputing._pairwise_corrcoef(values), y)
+
+    def test_asset_positions(self):
+        y = imputing.asset_positions(self.test_df.index, "asset_id")
+        self.assertEqual(list(y), ["a", "b"])
+        nptest.assert_array_equal(y["a"], np.arange(5))
+        nptest.assert_array_equal(y["b"], np.arange(5, 10))
+
+    def test_sort_neighbors(self):
+        # The neighbors above the threshold are in the same order as a full sort, including ties,
+        # and NaN values and correlations equal to the threshold are never among them
+        corr = np.array(
+            [
+                [np.nan, 0.9, 0.8, 0.9, np.nan, 0.7, 0.2, 0.95],
+                [0.9, np.nan, 0.7, 0.7, 0.1, 0.2, 0.3, 0.4],
+                [0.8, 0.7, np.nan, np.nan, np.nan, 0.75, 0.75, 0.75],
+                [0.9, 0.7, np.nan, np.nan, 0.6, 0.5, 0.4, 0.3],
+                [np.nan, 0.1, np.nan, 0.6, np.nan, 0.2, 0.2, 0.2],
+                [0.7, 0.2, 0.75, 0.5, 0.2, np.nan, 0.9, 0.9],
+                [0.2, 0.3, 0.75, 0.4, 0.2, 0.9, np.nan, 0.9],
+                [0.95, 0.4, 0.75, 0.3, 0.2, 0.9, 0.9, np.nan],
+            ]
+        )
+        r2_threshold = 0.7
+        for filled in (corr, np.nan_to_num(corr, nan=-2)):
+            y = (-filled).argsort(axis=1, kind="stable")
+            y_test = imputing._sort_neighbors(filled, r2_threshold)
+            for t in range(corr.shape[0]):
+                n_above = int((corr[t] > r2_threshold).sum())
+                nptest.assert_array_equal(y_test[t, :n_above], y[t, :n_above])
+                nptest.assert_array_equal(np.sort(y_test[t]), np.arange(corr.shape[1]))
+
+        # All rows are sorted when every correlation is below the threshold
+        filled = np.nan_to_num(corr, nan=-2)
+        y_test = imputing._sort_neighbors(filled, 0.99)
+        nptest.assert_array_equal(y_test, (-filled).argsort(axis=1, kind="stable"))
+
     def test_impute_data(self):
         # Test 1a, make sure single NaN is imputed using old style of inputs
         y = np.float64(2.989779)
@@ -357,7 +426,7 @@ class SimpleFilters(unittest.TestCase):
         # Test 1, pass data frame with three highly correlated assets, ensure all NaN data are imputed in
         # final output
         y_test = imputing.impute_all_assets_by_correlation(
-            self.test11_df, "data", "data", r2_threshold=0.7
+            self.test11_df, None, "data", "data", r2_threshold=0.7
         ).to_frame()
         y = pd.Series([0.440789, 3.401316, 14.3677, 42.8312, 62.887218, 96.734818])
         nptest.assert_array_almost_equal(
@@ -369,17 +438,108 @@ class SimpleFilters(unittest.TestCase):
         # Test 2, 3 highly correlated assets with less data, such that asset 'b' has no data imputed
         y = pd.Series([1.589147, np.nan, np.nan, np.nan, np.nan, np.nan, 123.7000])
         y_test = imputing.impute_all_assets_by_correlation(
-            self.test10_df, "data", "data", r2_threshold=0.7
+            self.test10_df, None, "data", "data", r2_threshold=0.7
         ).to_frame()
         nan_ind = self.test10_df.loc[self.test10_df["data"].isnull()].index
         nptest.assert_array_almost_equal(y_test.loc[nan_ind, "imputed_data"], y, decimal=4)
 
         # Test 3, 2 poorly correlated data sets, no data should be imputed
         y_test = imputing.impute_all_assets_by_correlation(
-            self.test12_df, "data", "data", r2_threshold=0.7
+            self.test12_df, None, "data", "data", r2_threshold=0.7
         ).to_frame()
         nptest.assert_array_almost_equal(y_test["imputed_data"], self.test12_df["data"], decimal=4)
 
+        # Test 4, the assets imputed in separate processes are combined the same way
+        y = imputing.impute_all_assets_by_correlation(
+            self.test11_df, None, "data", "data", r2_threshold=0.7
+        )
+        y_test = imputing.impute_all_assets_by_correlation(
+            self.test11_df, None, "data", "data", r2_threshold=0.7, multiprocessor="cf"
+        )
+        self.assertTrue(y_test.index.equals(self.test11_df.index))
+        nptest.assert_array_almost_equal(y_test, y)
+
+    def test_impute_all_assets_by_correlation_pl(self):
+        # Make sure the polars data, with a column per asset, are imputed the same as pandas data
+        for df in (self.test10_df, self.test11_df):
+            y = imputing.impute_all_assets_by_correlation(df, None, "data", "data", r2_threshold=0.7)
+            y = y.unstack()
+            data_pl = pl.from_pandas(df["data"].unstack().add_prefix("data_").reset_index())
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                y_test = imputing.impute_all_assets_by_correlation(
+                    None,
+                    data_pl.lazy(),
+                    "data",
+                    "data",
+                    r2_threshold=0.7,
+                    save_path=os.path.join(tmp_dir, "scada.parquet"),
+                ).collect()
+                self.assertTrue(os.path.exists(os.path.join(tmp_dir, "scada_data.parquet")))
+            nptest.assert_array_equal(y_test["time"], y.index)
+            y_test = y_test.select([f"data_{tid}" for tid in y.columns]).fill_null(np.nan)
+            nptest.assert_array_almost_equal(y_test.to_numpy(), y.to_numpy(), decimal=4)
+
+        # There are no updates to save for poorly correlated assets
+        data_pl = pl.from_pandas(self.test12_df["data"].unstack().add_prefix("data_").reset_index())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            y_test = imputing.impute_all_assets_by_correlation(
+                None,
+                data_pl.lazy(),
+                "data",
+                "data",
+                r2_threshold=0.7,
+                save_path=os.path.join(tmp_dir, "scada.parquet"),
+            )
+        self.assertIsNone(y_test)
+
+    @unittest.skipUnless(imputing.numba_exists, "numba is not installed")
+    def test_impute_target_id_pd_numba(self):
+        # Make sure the compiled neighbor walk matches the batched numpy fits
+        corr_df = imputing.asset_correlation_matrix_pd(self.test11_df, "data")
+        ix_sort = (-corr_df.fillna(-2)).values.argsort(axis=1)
+        sort_df = pd.DataFrame(corr_df.columns.to_numpy()[ix_sort], index=corr_df.index)
+        kwargs = dict(
+            data=self.test11_df,
+            corr_df=corr_df,
+            sort_df=sort_df,
+            r2_threshold=0.7,
+            asset_id_col="asset_id",
+            impute_df=self.test11_df,
+            impute_col="data",
+            reference_col="data",
+            method="linear",
+            degree=1,
+        )
+        for target_id in corr_df.columns:
+            _, y_test = imputing.impute_target_id_pd(target_id=target_id, **kwargs)
+            with mock.patch.object(imputing, "numba_exists", False):
+                _, y = imputing.impute_target_id_pd(target_id=target_id, **kwargs)
+            nptest.assert_array_almost_equal(y_test, y)
+
+        # A neighbor that is constant over the overlap with the target is skipped
+        df = pd.DataFrame(
+            data={
+                "time": ["01", "02", "03", "04", "05"] * 3,
+                "data": [0, np.nan, 4, 6, 8] + [1] * 5 + [2] * 5,
+                "ref": [0, 2, 4, 6, 8] + [5] * 5 + [0, 1, 2, 3, 4],
+                "asset_id": ["a"] * 5 + ["b"] * 5 + ["c"] * 5,
+            }
+        ).set_index(["time", "asset_id"])
+        corr_df = pd.DataFrame(
+            [[1.0, 0.9, 0.8], [0.9, 1.0, 0.8], [0.8, 0.8, 1.0]],
+            index=["a", "b", "c"],
+            columns=["a", "b", "c"],
+        )
+        sort_df = pd.DataFrame(
+            [["b", "c", "a"], ["a", "c", "b"], ["a", "b", "c"]], index=corr_df.index
+        )
+        kwargs.update(data=df, impute_df=df, corr_df=corr_df, sort_df=sort_df, reference_col="ref")
+        _, y_test = imputing.impute_target_id_pd(target_id="a", **kwargs)
+        with mock.patch.object(imputing, "numba_exists", False):
+            _, y = imputing.impute_target_id_pd(target_id="a", **kwargs)
+        nptest.assert_array_almost_equal(y_test["data"], [0, 2, 4, 6, 8])
+        nptest.assert_array_almost_equal(y_test, y)
+
     def tearDown(self):
         pass
 